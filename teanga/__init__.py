@@ -3,3 +3,11 @@ from .document import Document
 from .service import Service, rest_service
 from .layer_desc import LayerDesc
 from .rdf import teanga_corpus_to_rdf, teanga_corpus_to_nif, teanga_corpus_to_webanno
+
+def __getattr__(name):
+    # The stream module needs PyYAML, so it is imported on first use
+    if name == "stream":
+        from importlib import import_module
+        return import_module(".stream", __name__)
+    raise AttributeError("module " + repr(__name__) + " has no attribute " +
+                         repr(name))
@@ -1,36 +1,105 @@
 from typing import TYPE_CHECKING
 from .document import Document
 from .service import Service
-from .utils import teanga_id_for_doc
-from .layer_desc import LayerDesc, _layer_desc_from_kwargs, _from_layer_desc
+from .utils import teanga_id_for_doc, _json_loads
+from .layer_desc import (LayerDesc, _layer_desc_from_kwargs, _from_layer_desc,
+                         _VALID_LAYER_TYPES)
 if TYPE_CHECKING:
     from .groups import GroupedCorpus
     from .transforms import TransformedCorpus
-from .stream import CorpusStream, CorpusWriter
+    from .stream import CorpusStream, CorpusWriter
+
+def __getattr__(name):
+    # The stream classes need PyYAML, so they are imported on first use
+    if name == "CorpusStream" or name == "CorpusWriter":
+        from . import stream
+        return getattr(stream, name)
+    raise AttributeError("module " + repr(__name__) + " has no attribute " +
+                         repr(name))
 
-try:
-    import teanga_pyo3.teanga as teanga_pyo3
-    TEANGA_PYO3 = True
-except ImportError:
-    TEANGA_PYO3 = False
 import shutil
+import sys
 import os
 import json
-import yaml
-try:
-    from yaml import CLoader as YamlLoader
-except ImportError:
-    from yaml import FullLoader as YamlLoader
 import gzip
 import tempfile
-from io import StringIO
-from itertools import chain
+from itertools import chain, islice
+from concurrent.futures import ThreadPoolExecutor
 from typing import Iterator, Union, Callable, Iterable, Tuple, List, Optional
 from abc import ABC, abstractmethod
-from collections import Counter, defaultdict
-from urllib.request import urlopen
+from functools import lru_cache, partial
+from operator import eq
+from math import exp, floor, log, log1p
+from collections import Counter, OrderedDict, defaultdict
+from urllib.request import urlopen, Request
+from importlib.util import find_spec
 import re
 
+# The Rust backend is only looked up here, it is loaded by the first
+# DB-backed corpus
+TEANGA_PYO3 = find_spec("teanga_pyo3") is not None
+_pyo3_module = None
+
+def _teanga_pyo3():
+    """Return the teanga_pyo3 module, importing it if needed"""
+    global _pyo3_module
+    if _pyo3_module is None:
+        try:
+            import teanga_pyo3.teanga as teanga_pyo3
+        except ImportError:
+            teanga_db_fail()
+        _pyo3_module = teanga_pyo3
+    return _pyo3_module
+
+# PyYAML is imported on first use, so `import teanga` does not pay for it
+_yaml = None
+_YamlLoader = None
+_YamlDumper = None
+
+def _get_yaml():
+    """Return the yaml module, importing it and choosing a loader and dumper
+    if needed"""
+    global _yaml, _YamlLoader, _YamlDumper
+    if _yaml is None:
+        import yaml
+        try:
+            _YamlLoader = yaml.CSafeLoader
+            _YamlDumper = yaml.CSafeDumper
+        except AttributeError:
+            _YamlLoader = yaml.SafeLoader
+            _YamlDumper = yaml.SafeDumper
+        _yaml = yaml
+    return _yaml
+
+def _yaml_load(stream):
+    """Parse a YAML string or file"""
+    return _get_yaml().load(stream, Loader=_YamlLoader)
+
+def _yaml_parse(stream):
+    """Return the parsing events of a YAML string or file"""
+    return _get_yaml().parse(stream, Loader=_YamlLoader)
+
+# Size of the buffer used when writing a corpus to a file
+WRITE_BUFFER_SIZE = 1 << 20
+
+# The first bytes of gzip compressed data
+GZIP_MAGIC = b"\x1f\x8b"
+
+# Bound once to skip the keyword handling `json.dumps` repeats on every call.
+# The stdlib encoder's separators and ASCII escaping are part of the format.
+# Layer values are plain lists, strings and numbers from the documents and
+# cannot contain cycles, so the encoder's cycle check is skipped.
+_json_dumps = json.JSONEncoder(check_circular=False).encode
+
+# YAML files larger than this many bytes are read incrementally by `read_yaml`
+YAML_STREAM_THRESHOLD = 1 << 26
+
+# Strings up to this length are cached when formatted as YAML
+YAML_STR_CACHE_LENGTH = 64
+
+# The number of documents of a DB-backed corpus kept in memory by `doc_by_id`
+DOC_CACHE_SIZE = 1024
+
 
 class ImmutableCorpus(ABC):
     """An abstract base class for immutable corpora.
@@ -67,6 +136,25 @@ class ImmutableCorpus(ABC):
         for doc_id in self.doc_ids:
             yield self.doc_by_id(doc_id)
 
+    def raw_docs(self) -> Iterator[Tuple[str, dict]]:
+        """Get the raw data of all the documents in the corpus, as it is
+        serialized, without needing to construct Document objects.
+
+        Returns:
+            An iterator over pairs of a document id and a dictionary from the
+            layer names (and metadata names prefixed with `_`) to raw values.
+
+        Examples:
+            >>> corpus = text_corpus()
+            >>> doc = corpus.add_doc("This is a document.")
+            >>> doc._author = "John"
+            >>> list(corpus.raw_docs())
+            [('Kjco', {'text': 'This is a document.', '_author': 'John'})]
+        """
+        prefixed = {}
+        for doc in self.docs:
+            yield doc.id, _raw_doc(doc, prefixed)
+
     @property
     @abstractmethod
     def meta(self) -> dict[str, LayerDesc]:
@@ -84,6 +172,11 @@ class ImmutableCorpus(ABC):
         Returns:
             A list of document ids in the order they appear in the corpus.
         """
+        return list(self._doc_order())
+
+    def _doc_order(self) -> list[str]:
+        """Return the document ids in order, for lookups by position. The
+        list must not be modified"""
         return list(self.doc_ids)
 
     def __getitem__(self, key:str) -> Document:
@@ -104,138 +197,15 @@ class ImmutableCorpus(ABC):
             [Document('Kjco', {'text': 'This is a document.'})]
         """
         if isinstance(key, int):
-            return self.doc_by_id(self.order[key])
+            return self.doc_by_id(self._doc_order()[key])
         elif isinstance(key, slice):
-            doc_ids = self.order
+            doc_ids = self._doc_order()
             return [self.doc_by_id(doc_id) for doc_id in doc_ids[key]]
         elif isinstance(key, str):
             return self.doc_by_id(key)
         else:
             raise Exception("Invalid key type.")
 
-    def view(self, *args):
-        """Create a view on the corpus.
-
-        Parameters:
-        -----------
-            args: str
-                The names of the layers to view.
-
-        Examples:
-        ---------
-
-        >>> corpus = Corpus()
-        >>> corpus.add_layer_meta("text")
-        >>> corpus.add_layer_meta("words", layer_type="span", base="text")
-        >>> corpus.add_layer_meta("sentences", layer_type="div", base="words")
-        >>> doc = corpus.add_doc("This is a sentence. This is another sentence.")
-        >>> doc.words = [(0, 4), (5, 7), (8, 9), (10, 18), (20, 24), (25, 27),
-        ...               (28, 35), (36, 44)]
-        >>> doc.sentences = [0, 4]
-        >>> doc.view("words", "sentences")
-        [['This', 'is', 'a', 'sentence'], ['This', 'is', 'another', 'sentence']]
-        """
-        for doc_id, doc in self.docs:
-            yield doc.view(*args)
-
-    def text_freq(self, layer:str,
-                  condition : Union[str,
-            Callable[[str], bool], list] = None) -> dict[str, int]:
-        """Get the frequence of a text string in the corpus.
-
-        Args:
-            layer
-                The layer to get the frequency of (e.g. "text")
-            condition
-                A filter to match to. If a single string is given, the frequency
-                of this single word is returned. If a list of strings is given, the
-                frequency of each string is returned. If a function is given, all
-                strings are returned for which the function returns True.
-
-        Returns:
-            A dictionary with the frequency of each string.
-
-        Examples:
-            >>> corpus = text_corpus()
-            >>> doc = corpus.add_doc("This is a document.")
-            >>> doc.tokens = [(0, 4), (5, 7), (8, 9), (10, 18)]
-            >>> corpus.text_freq("tokens")
-            Counter({'This': 1, 'is': 1, 'a': 1, 'document': 1})
-            >>> corpus.text_freq("tokens", lambda x: "i" in x)
-            Counter({'This': 1, 'is': 1})
-        """
-        if condition is None:
-            return Counter(word
-                for doc in self.docs
-                for word in doc[layer].text)
-        elif isinstance(condition, str):
-            return Counter(word
-                for doc in self.docs
-                           for word in doc[layer].text
-                           if word == condition)
-        elif callable(condition):
-            return Counter(word
-                for doc in self.docs
-                for word in doc[layer].text
-                           if condition(word))
-        else:
-            return Counter(word
-                for doc in self.docs
-                for word in doc[layer].text
-                           if word in condition)
-
-    def val_freq(self, layer:str,
-                 condition = None) -> Counter:
-        """Get the frequency of a value in a layer.
-
-        Args:
-            layer
-                The layer to get the frequency of (e.g. "pos")
-            condition
-                The value to get the frequency of. If a single value is given, the
-                frequency of this single value is returned. If a list of values is
-                given, the frequency of each value is returned. If a function is
-                given, all values are returned for which the function returns True.
-
-        Returns:
-            A dictionary with the frequency of each value.
-
-        Examples:
-            >>> corpus = Corpus()
-            >>> corpus.add_layer_meta("text")
-            >>> corpus.add_layer_meta("words", layer_type="span", base="text")
-            >>> corpus.add_layer_meta("pos", layer_type="seq", base="words",
-            ...                        data=["NOUN", "VERB", "ADJ"])
-            >>> doc = corpus.add_doc("Colorless green ideas sleep furiously.")
-            >>> doc.words = [(0, 9), (10, 15), (16, 21), (22, 28), (29, 37)]
-            >>> doc.pos = ["ADJ", "ADJ", "NOUN", "VERB", "ADV"]
-            >>> corpus.val_freq("pos")
-            Counter({'ADJ': 2, 'NOUN': 1, 'VERB': 1, 'ADV': 1})
-            >>> corpus.val_freq("pos", ["NOUN", "VERB"])
-            Counter({'NOUN': 1, 'VERB': 1})
-            >>> corpus.val_freq("pos", lambda x: x[0] == "A")
-            Counter({'ADJ': 2, 'ADV': 1})
-        """
-        if condition is None:
-            return Counter(val
-                for doc in self.docs
-                for val in doc[layer].data)
-        elif isinstance(condition, str):
-            return Counter(val
-                for doc in self.docs
-                for val in doc[layer].data
-                           if val == condition)
-        elif callable(condition):
-            return Counter(val
-                for doc in self.docs
-                for val in doc[layer].data
-                           if condition(val))
-        else:
-            return Counter(val
-                for doc in self.docs
-                for val in doc[layer].data
-                           if val in condition)
-
     def by_doc(self) -> 'GroupedCorpus':
         """Group the corpus by document to enable analysis such as frequency
         analysis on a per document basis.
@@ -275,14 +245,13 @@ class ImmutableCorpus(ABC):
         """
         from .groups import GroupedCorpus
         grouping = defaultdict(list)
+        by_text = self.meta[layer].data is None
         for doc in self.docs:
-            if layer in doc:
-                if self.meta[layer].data is None:
-                    for value in doc[layer].text:
-                        grouping[value].append(doc.id)
-                else:
-                    for value in doc[layer].data:
-                        grouping[value].append(doc.id)
+            layer_obj = doc.layers.get(layer)
+            if layer_obj is not None:
+                values = layer_obj.text if by_text else layer_obj.data
+                for value in values:
+                    grouping[value].append(doc.id)
         return GroupedCorpus(self, grouping)
 
     def subset(self, values: Union[Iterable[str], Iterable[int]]) -> 'ImmutableCorpus':
@@ -308,11 +277,13 @@ class ImmutableCorpus(ABC):
             ['Kjco', 'eDFn']
         """
         val_ids = []
-        doc_ids = list(self.doc_ids)
+        doc_ids = None
         for value in values:
             if isinstance(value, str):
                 val_ids.append(value)
             elif isinstance(value, int):
+                if doc_ids is None:
+                    doc_ids = self._doc_order()
                 val_ids.append(doc_ids[value])
             else:
                 raise Exception("Invalid value type: " + str(type(value)))
@@ -339,11 +310,9 @@ class ImmutableCorpus(ABC):
             2
         """
         from .filter import SubsetCorpus
-        import random
-        doc_ids = list(self.doc_ids)
-        if k > len(doc_ids):
+        sampled_ids = _reservoir_sample(self.doc_ids, k)
+        if len(sampled_ids) < k:
             raise ValueError("Sample size k cannot be greater than the number of documents in the corpus.")
-        sampled_ids = random.sample(doc_ids, k)
         return SubsetCorpus(self, sampled_ids)
 
 
@@ -392,8 +361,10 @@ class ImmutableCorpus(ABC):
         >>> doc.sentences = [0, 4]
         >>> doc.view("words", "sentences")
         [['This', 'is', 'a', 'sentence'], ['This', 'is', 'another', 'sentence']]
+        >>> list(corpus.view("words", "sentences"))
+        [[['This', 'is', 'a', 'sentence'], ['This', 'is', 'another', 'sentence']]]
         """
-        for doc_id, doc in self.docs:
+        for doc in self.docs:
             yield doc.view(*args)
 
     def text_freq(self, layer:str,
@@ -422,25 +393,11 @@ class ImmutableCorpus(ABC):
             >>> corpus.text_freq("tokens", lambda x: "i" in x)
             Counter({'This': 1, 'is': 1})
         """
-        if condition is None:
-            return Counter(word
-                for doc in self.docs
-                for word in doc[layer].text)
-        elif isinstance(condition, str):
-            return Counter(word
-                for doc in self.docs
-                           for word in doc[layer].text
-                           if word == condition)
-        elif callable(condition):
-            return Counter(word
-                for doc in self.docs
-                for word in doc[layer].text
-                           if condition(word))
-        else:
-            return Counter(word
-                for doc in self.docs
-                for word in doc[layer].text
-                           if word in condition)
+        words = chain.from_iterable(doc[layer].text for doc in self.docs)
+        predicate = _freq_predicate(condition)
+        if predicate is None:
+            return Counter(words)
+        return Counter(filter(predicate, words))
 
     def val_freq(self, layer:str,
                  condition = None) -> Counter:
@@ -474,27 +431,11 @@ class ImmutableCorpus(ABC):
             >>> corpus.val_freq("pos", lambda x: x[0] == "A")
             Counter({'ADJ': 2, 'ADV': 1})
         """
-        if condition is None:
-            return Counter(val
-                for doc in self.docs
-                for val in doc[layer].data)
-        elif isinstance(condition, str):
-            return Counter(val
-                for doc in self.docs
-                for val in doc[layer].data
-                           if val == condition)
-        elif callable(condition):
-            return Counter(val
-                for doc in self.docs
-                for val in doc[layer].data
-                           if condition(val))
-        else:
-            return Counter(val
-                for doc in self.docs
-                for val in doc[layer].data
-                           if val in condition)
-
-
+        vals = chain.from_iterable(doc[layer].data for doc in self.docs)
+        predicate = _freq_predicate(condition)
+        if predicate is None:
+            return Counter(vals)
+        return Counter(filter(predicate, vals))
 
     def search(self, query=None, **kwargs) -> Iterator[str]:
         """Search for documents in the corpus.
@@ -562,6 +503,8 @@ class ImmutableCorpus(ABC):
             []
             >>> list(corpus.search(pos="VERB", words="ideas"))
             ['9wpe']
+            >>> list(corpus.search(pos="ADJ", words="Colorless"))
+            ['9wpe']
             >>> list(corpus.search({"pos": "VERB", "lemma": "sleep"}))
             ['9wpe']
             >>> list(corpus.search({"$and": {"pos": "VERB", "lemma": "sleep"}}))
@@ -570,51 +513,60 @@ class ImmutableCorpus(ABC):
         if kwargs and query:
             raise Exception("Cannot specify both query and kwargs.")
         if kwargs:
-            for doc in self.docs:
-                if all(next(doc[layer].matches(value), None)
-                       for layer, value in kwargs.items()):
-                    yield doc.id
+            for doc_id in _layer_matches(self.docs, self.meta, kwargs):
+                yield doc_id
         else:
+            test = self._compile_query(query)
             for doc in self.docs:
-                for key, value in query.items():
-                    if not self._doc_matches(doc, key, value):
-                        break
-                else:
+                if test(doc):
                     yield doc.id
 
-    def _doc_matches(self, doc, key, value):
+    def _compile_query(self, query: dict) -> Callable[[Document], bool]:
+        """Turn a query into a test on documents, so that its operators are
+        resolved once rather than for every document"""
+        tests = [self._compile_condition(key, value)
+                 for key, value in query.items()]
+        if len(tests) == 1:
+            return tests[0]
+        return lambda doc: all(test(doc) for test in tests)
+
+    def _compile_condition(self, key: str, value) -> Callable[[Document], bool]:
+        """Turn a single condition of a query into a test on documents"""
         if key == "$exists":
-            return value in doc.layers
+            return lambda doc: value in doc.layers
         elif key == "$and":
-            return all(self._doc_matches(doc, k, v) for k, v in value.items())
+            return self._compile_query(value)
         elif key == "$or":
-            return any(self._doc_matches(doc, k, v) for k, v in value.items())
+            tests = [self._compile_condition(k, v) for k, v in value.items()]
+            return lambda doc: any(test(doc) for test in tests)
         elif key == "$not":
             if isinstance(value, dict):
-                return all(self._doc_matches(doc, k, v) for k, v in value.items())
+                test = self._compile_query(value)
+                return lambda doc: not test(doc)
             else:
                 raise Exception("Invalid $not query.")
         elif key in self.meta:
-            return doc[key].matches(value)
+            return lambda doc: any(True for _ in doc[key].matches(value) or ())
         else:
             raise Exception("Invalid key: " + key)
 
-
     def normalise_query(self, query):
         """Normalise a query by replacing all field values with either `$eq` or
         `$text`
         """
+        meta = self.meta
         q2 = {}
         for key, value in query.items():
+            is_text = key in meta and meta[key].data is None
             if isinstance(value, list):
                 if all(isinstance(v, str) for v in value):
-                    if key in self.meta and self.meta[key].data is None:
+                    if is_text:
                         q2[key] = {"$text_in": value}
                     else:
                         q2[key] = {"$in": value}
             elif isinstance(value, dict):
                 q2[key] = value
-            elif key in self.meta and self.meta[key].data is None:
+            elif is_text:
                 q2[key] = {"$text": value}
             else:
                 q2[key] = {"$eq": value}
@@ -684,9 +636,9 @@ class ImmutableCorpus(ABC):
         if layer_name not in self.meta:
             raise Exception("Layer " + layer_name + " not found in corpus.")
         for doc in self.docs:
-            if layer_name in doc:
-                for text in doc[layer_name].text:
-                    yield text
+            layer = doc.layers.get(layer_name)
+            if layer is not None:
+                yield from layer.text
 
     def all_data(self, layer_name: str) -> Iterator:
         """Get the combined data of a single layer in the order of the corpus.
@@ -715,9 +667,9 @@ class ImmutableCorpus(ABC):
         if layer_name not in self.meta:
             raise Exception("Layer " + layer_name + " not found in corpus.")
         for doc in self.docs:
-            if layer_name in doc:
-                for data in doc[layer_name].data:
-                    yield data
+            layer = doc.layers.get(layer_name)
+            if layer is not None:
+                yield from layer.data
 
     def to_yaml(self, path_or_buf : str):
         """Write the corpus to a yaml file.
@@ -728,10 +680,13 @@ class ImmutableCorpus(ABC):
 
         """
         if isinstance(path_or_buf, str):
-            with open(path_or_buf, "w") as f:
-                self._to_pretty_yaml(f)
+            with open(path_or_buf, "w", encoding="utf-8",
+                      buffering=WRITE_BUFFER_SIZE) as f:
+                f.writelines(self._iter_yaml())
         else:
-            self._to_pretty_yaml(path_or_buf)
+            # Buffers given by the caller only need a `write` method
+            for chunk in self._iter_yaml():
+                path_or_buf.write(chunk)
 
     def to_yaml_str(self) -> str:
         """
@@ -745,59 +700,33 @@ class ImmutableCorpus(ABC):
             '_meta:\\n    text:\\n        type: characters\\n\
 Kjco:\\n    text: This is a document.\\n'
         """
-        s = StringIO()
-        self._to_pretty_yaml(s)
-        return s.getvalue()
-
-    def _to_pretty_yaml(self, writer):
-        """
-        """
-        writer.write("_meta:\n")
-        for name in sorted(self.meta.keys()):
-            meta = self.meta[name]
-            writer.write("    " + name + ":\n")
-            writer.write("        type: " + meta.layer_type + "\n")
-            if meta.base:
-                writer.write("        base: " + _yaml_str(meta.base))
-            if meta.data:
-                writer.write("        data: " +
-                             self._dump_yaml_json(meta.data))
-            if meta.link_types:
-                writer.write("        link_types: " +
-                             self._dump_yaml_json(meta.link_types))
-            if meta.target:
-                writer.write("        target: " +
-                             self._dump_yaml_json(meta.target))
-            if meta.default:
-                writer.write("        default: " +
-                             self._dump_yaml_json(meta.default))
-        for id in self.doc_ids:
-            doc = self.doc_by_id(id)
-            if re.match(r"^[-+]?(0b[0-1_]+|0o[0-7_]+|0x[0-9a-fA-F_]+|[0-9][0-9_]*)$", id) or id == "true" or id == "True" or id == "TRUE" or id == "false" or id == "False" or id == "FALSE":
-                writer.write("\"" + id + "\":\n")
-            else:
-                writer.write(id + ":\n")
-            for layer_id in sorted(doc.layers):
-                writer.write("    ")
-                if isinstance(doc[layer_id].raw, str):
-                    writer.write(layer_id)
-                    writer.write(": ")
-                    writer.write(_yaml_str(doc[layer_id].raw))
+        return "".join(self._iter_yaml())
+
+    def _iter_yaml(self) -> Iterator[str]:
+        """Yield the yaml serialization, one chunk per document."""
+        yield self._meta_yaml()
+        # Documents of a corpus usually have the same layers, so the sorted
+        # layer names are reused while the keys stay the same. Otherwise
+        # they are picked from the sorted names of all the layers
+        layer_order = sorted(self.meta)
+        keys = layer_ids = None
+        for doc_id, raw in self.raw_docs():
+            lines = [_yaml_key(doc_id)]
+            doc_keys = tuple(raw)
+            if doc_keys != keys:
+                keys = doc_keys
+                layer_ids = [name for name in layer_order if name in raw]
+            for layer_id in layer_ids:
+                value = raw[layer_id]
+                if isinstance(value, str):
+                    lines.append("    " + layer_id + ": " + _yaml_str(value))
                 else:
-                    writer.write(layer_id + ": ")
-                    writer.write(json.dumps(doc[layer_id].raw) + "\n")
-            for key, value in doc.metadata.items():
-                writer.write("    _" + key + ": " + _yaml_str(value))
-
-    def _dump_yaml_json(self, obj):
-        """
-        """
-        if obj is None:
-            return "null"
-        elif isinstance(obj, str):
-            return _yaml_str(obj)
-        else:
-            return json.dumps(obj) + "\n"
+                    lines.append("    " + layer_id + ": " +
+                                 _json_dumps(value) + "\n")
+            for key, value in raw.items():
+                if key[0] == "_":
+                    lines.append("    " + key + ": " + _yaml_str(value))
+            yield "".join(lines)
 
     def to_json(self, path_or_buf):
         """Write the corpus to a JSON file.
@@ -808,10 +737,13 @@ Kjco:\\n    text: This is a document.\\n'
 
         """
         if isinstance(path_or_buf, str):
-            with open(path_or_buf, "w") as f:
-                self._to_json(f)
+            with open(path_or_buf, "w", encoding="utf-8",
+                      buffering=WRITE_BUFFER_SIZE) as f:
+                f.writelines(self._iter_json())
         else:
-            self._to_json(path_or_buf)
+            # Buffers given by the caller only need a `write` method
+            for chunk in self._iter_json():
+                path_or_buf.write(chunk)
 
     def to_json_str(self) -> str:
         """
@@ -824,23 +756,51 @@ Kjco:\\n    text: This is a document.\\n'
             >>> corpus.to_json_str()
             '{"_meta": {"text": {"type": "characters"}}, "_order": ["Kjco"], "Kjco": {"text": "This is a document."}}'
          """
-        s = StringIO()
-        self._to_json(s)
-        return s.getvalue()
-
-    def _to_json(self, writer):
-        dct = {}
-        dct["_meta"] = {name: _from_layer_desc(data)
-                        for name, data in self.meta.items()
-                        if not name.startswith("_")}
-        dct["_order"] = list(self.doc_ids)
-        for doc_id in self.doc_ids:
-            doc = self.doc_by_id(doc_id)
-            dct[doc_id] = {layer_id: doc[layer_id].raw
-                           for layer_id in doc.layers}
-            dct[doc_id].update({"_" + key: value
-                                for key, value in doc.metadata.items()})
-        json.dump(dct, writer)
+        return "".join(self._iter_json())
+
+    def _iter_json(self) -> Iterator[str]:
+        """Generate the JSON text of the corpus in pieces, one document at a
+        time, so that the whole corpus is never held as a single dictionary"""
+        yield "{\"_meta\": " + self._meta_json()
+        yield ", \"_order\": " + _json_dumps(list(self.doc_ids))
+        for doc_id, raw in self.raw_docs():
+            yield ", " + _json_dumps(doc_id) + ": " + _json_dumps(raw)
+        yield "}"
+
+    def _char_layers(self) -> tuple:
+        """Return the names of the character layers of the corpus"""
+        return tuple(name for name, desc in self.meta.items()
+                     if desc.layer_type == "characters")
+
+    def _meta_json(self) -> str:
+        """Return the `_meta` section of the corpus as JSON"""
+        return _json_dumps({name: _from_layer_desc(data)
+                            for name, data in self.meta.items()
+                            if not name.startswith("_")})
+
+    def _meta_yaml(self) -> str:
+        """Return the `_meta` section of the corpus as YAML"""
+        lines = ["_meta:\n"]
+        all_meta = self.meta
+        for name in sorted(all_meta.keys()):
+            meta = all_meta[name]
+            lines.append("    " + name + ":\n")
+            lines.append("        type: " + meta.layer_type + "\n")
+            if meta.base:
+                lines.append("        base: " + _yaml_str(meta.base))
+            if meta.data:
+                lines.append("        data: " +
+                             _dump_yaml_json(meta.data))
+            if meta.link_types:
+                lines.append("        link_types: " +
+                             _dump_yaml_json(meta.link_types))
+            if meta.target:
+                lines.append("        target: " +
+                             _dump_yaml_json(meta.target))
+            if meta.default:
+                lines.append("        default: " +
+                             _dump_yaml_json(meta.default))
+        return "".join(lines)
 
     def to_cuac(self, path:str):
         """Write the corpus to a Cuac file.
@@ -849,13 +809,13 @@ Kjco:\\n    text: This is a document.\\n'
             path: str
                 The path to the Cuac file.
         """
-        if not TEANGA_PYO3:
-            teanga_db_fail()
-        tmpfile = tempfile.mkstemp()[1]
-        self.to_json(tmpfile)
-        tmppath = tempfile.mkdtemp()
-        corpus = teanga_pyo3.read_corpus_from_json_file(tmpfile, tmppath)
-        teanga_pyo3.write_corpus_to_cuac(corpus, path)
+        teanga_pyo3 = _teanga_pyo3()
+        # The database is only needed until the Cuac file is written
+        with tempfile.TemporaryDirectory() as tmppath:
+            corpus = teanga_pyo3.read_corpus_from_json_string(
+                    self.to_json_str(), tmppath)
+            teanga_pyo3.write_corpus_to_cuac(corpus, path)
+            del corpus
 
     def lower(self) -> 'TransformedCorpus':
         """Lowercase all the text in the corpus.
@@ -869,10 +829,8 @@ Kjco:\\n    text: This is a document.\\n'
             [Document('Kjco', {'text': 'this is a document.'})]
         """
         from .transforms import TransformedCorpus
-        text_layers = [layer for layer in self.meta
-                       if self.meta[layer].layer_type == "characters"]
-        return TransformedCorpus(self, {layer: lambda x: x.lower()
-                                        for layer in text_layers})
+        return TransformedCorpus(self, dict.fromkeys(self._char_layers(),
+                                                     str.lower))
 
     def upper(self) -> 'TransformedCorpus':
         """Uppercase all the text in the corpus.
@@ -885,10 +843,8 @@ Kjco:\\n    text: This is a document.\\n'
             [Document('Kjco', {'text': 'THIS IS A DOCUMENT.'})]
         """
         from .transforms import TransformedCorpus
-        text_layers = [layer for layer in self.meta
-                       if self.meta[layer].layer_type == "characters"]
-        return TransformedCorpus(self, {layer: lambda x: x.upper()
-                                        for layer in text_layers})
+        return TransformedCorpus(self, dict.fromkeys(self._char_layers(),
+                                                     str.upper))
 
     def transform(self, layer: str, transform:
                   Callable[[str], str]) -> 'TransformedCorpus':
@@ -910,7 +866,7 @@ Kjco:\\n    text: This is a document.\\n'
         from .transforms import TransformedCorpus
         return TransformedCorpus(self, {layer: transform})
 
-    def writer(self, buf) -> CorpusWriter:
+    def writer(self, buf) -> 'CorpusWriter':
         """Create a writer object that can serialize documents in 
         a streaming fashion.
 
@@ -927,6 +883,7 @@ Kjco:\\n    text: This is a document.\\n'
             ...     for doc in corpus.docs:
             ...         writer.write(doc)
         """
+        from .stream import CorpusWriter
         return CorpusWriter(buf, self.meta)
 
     def _repr_html_(self):
@@ -958,15 +915,18 @@ class Corpus(ImmutableCorpus):
         >>> doc = corpus.add_doc("This is a document.")
     """
     def __init__(self, db=None, new=False, db_corpus=None):
+        self._doc_cache = OrderedDict()
+        self._pyo3_meta = None
+        self._doc_id_set = None
+        self._search_index = {}
+        self._order_cache = None
         if db_corpus:
             self._pyo3 = db_corpus
             self.meta = self._pyo3.meta
         elif db:
-            if not TEANGA_PYO3:
-                teanga_db_fail()
             if new and os.path.exists(db):
                 shutil.rmtree(db)
-            self._pyo3 = teanga_pyo3.Corpus(db)
+            self._pyo3 = _teanga_pyo3().Corpus(db)
             self.meta = self._pyo3.meta
         else:
             self._pyo3 = None
@@ -1002,14 +962,14 @@ class Corpus(ImmutableCorpus):
                 raise Exception("Layer with name " + name +
                                 " already exists with different meta.")
             elif name not in self.meta:
-                self.add_layer_meta(name, **layer)
+                self.add_layer_meta(name, **desc._asdict())
 
 
     def add_layer_meta(self, name:str=None,
                        layer_type:str="characters", base:str=None,
                        data=None, link_types:list[str]=None,
                        target:str=None, default=None,
-                       meta:dict={}):
+                       meta:dict=None):
         """Add a layer to the corpus.
 
         Args:
@@ -1035,18 +995,23 @@ class Corpus(ImmutableCorpus):
         if self._pyo3:
             self._pyo3.add_layer_meta(
                     name, layer_type, {}, base, data, link_types, target, default)
+            self._meta_changed()
             return
         if name is None:
             raise Exception("Name of the layer is not specified.")
+        name = sys.intern(name)
         if name in self.meta:
             raise Exception("Layer with name " + name + " already exists.")
-        if layer_type not in ["characters", "span", "seq", "div", "element"]:
+        if layer_type not in _VALID_LAYER_TYPES:
             raise Exception("Type of the layer is not valid.")
         if layer_type == "characters" and base is not None and base != "":
             raise Exception("Layer of type characters cannot be based on" +
             " another layer.")
+        self._meta_changed()
+        # Each layer gets its own copy of the metadata properties
+        meta = None if meta is None else dict(meta)
         if layer_type == "characters":
-            self.meta[name] = LayerDesc("characters")
+            self.meta[name] = LayerDesc("characters", meta=meta)
             return
         if base is None:
             raise Exception("Layer of type " + layer_type + " must be based on " +
@@ -1076,56 +1041,107 @@ class Corpus(ImmutableCorpus):
             if self._pyo3:
                 self._pyo3.add_doc({layer_id: doc[layer_id].raw
                                      for layer_id in doc.layers})
+                self._doc_id_set = None
             else:
                 self._docs[doc.id] = doc
+            self._docs_changed()
             return doc
-        char_layers = [name for (name, layer) in self.meta.items()
-                       if layer.layer_type == "characters"]
-        if len(char_layers) == 0:
-            raise Exception("No character layer found. " +
-            "Please add at least one character layer.")
-        elif len(char_layers) == 1:
+        char_layers = self._char_layers()
+        if len(char_layers) == 1:
             if len(args) == 1:
-                doc_id = teanga_id_for_doc(self.doc_ids,
-                        **{char_layers[0]: args[0]})
-                doc = Document(self.meta, id=doc_id, corpus_ref=self, **{char_layers[0]: args[0]})
-                if self._pyo3:
-                    self._pyo3.add_doc({ char_layers[0]: args[0] })
-                    doc._pyo3 = self._pyo3
-                else:
-                    self._docs[doc_id] = doc
-                return doc
-            elif len(kwargs) == 1 and list(kwargs.keys())[0] == char_layers[0]:
-                doc_id = teanga_id_for_doc(self.doc_ids,
-                                           **kwargs)
-                doc = Document(self.meta, id=doc_id, corpus_ref=self, **kwargs)
-                if self._pyo3:
-                    self._pyo3.add_doc(**kwargs)
-                    doc._pyo3 = self._pyo3
-                else:
-                    self._docs[doc_id] = doc
-                return doc
+                return self._add_text({char_layers[0]: args[0]})
+            elif len(kwargs) == 1 and next(iter(kwargs)) == char_layers[0]:
+                return self._add_text(kwargs)
             else:
                 raise Exception("Invalid arguments, please specify the text " +
                                 "or use correct layer names.")
+        elif len(char_layers) == 0:
+            raise Exception("No character layer found. " +
+            "Please add at least one character layer.")
         else:
             if len(kwargs.keys()) == 0:
                 raise Exception("More than one character layer found " +
                                 f"{' '.join(char_layers)} " +
                                 "Please specify the layer names to add")
-            if set(kwargs.keys()).issubset(set(char_layers)):
-                doc_id = teanga_id_for_doc(self.doc_ids,
-                                           **kwargs)
-                doc = Document(self.meta, id=doc_id, corpus_ref=self, **kwargs)
+            if kwargs.keys() <= self._char_layer_set():
+                return self._add_text(kwargs)
+            else:
+                raise Exception("Invalid arguments, please specify the text " +
+                                "or use correct layer names.")
+
+    def _add_text(self, text: dict) -> Document:
+        """Add a document from the text of its character layers, which the
+        caller has already checked against the metadata"""
+        doc_id = teanga_id_for_doc(self._known_ids(), **text)
+        doc = Document(self.meta, id=doc_id, corpus_ref=self, **text)
+        if self._pyo3:
+            self._pyo3.add_doc(text)
+            doc._pyo3 = self._pyo3
+            self._doc_id_set.add(doc_id)
+            self._cache_doc(doc)
+        else:
+            self._docs[doc_id] = doc
+        self._docs_changed()
+        return doc
+
+    def add_docs(self, docs: Iterable[Union[str, dict]]) -> List[Document]:
+        """Add several documents to the corpus.
+
+        Args:
+            docs: Iterable[Union[str, dict]]
+                The documents to add. Each document is either a string, if the
+                corpus has only a single character layer, or a dictionary from
+                the names of character layers to their text.
+
+        Returns:
+            The list of added documents.
+
+        Examples:
+            >>> corpus = text_corpus()
+            >>> docs = corpus.add_docs(["This is a document.",
+            ...                         "This is another document."])
+            >>> list(corpus.doc_ids)
+            ['Kjco', 'eDFn']
+
+            >>> corpus = parallel_corpus(["en", "nl"])
+            >>> docs = corpus.add_docs([{"en": "This is a document.",
+            ...                          "nl": "Dit is een document."}])
+        """
+        meta = self.meta
+        char_layers = self._char_layers()
+        if len(char_layers) == 0:
+            raise Exception("No character layer found. " +
+            "Please add at least one character layer.")
+        char_layer_set = self._char_layer_set()
+        ids = self._known_ids()
+        added = []
+        # Documents added before a failing one stay, so the cached order is
+        # dropped however the loop ends
+        try:
+            for text in docs:
+                if isinstance(text, str):
+                    if len(char_layers) > 1:
+                        raise Exception("More than one character layer found " +
+                                        f"{' '.join(char_layers)} " +
+                                        "Please specify the layer names to add")
+                    text = {char_layers[0]: text}
+                elif not text or not text.keys() <= char_layer_set:
+                    raise Exception("Invalid arguments, please specify the text " +
+                                    "or use correct layer names.")
+                doc_id = teanga_id_for_doc(ids, **text)
+                doc = Document(meta, id=doc_id, corpus_ref=self, **text)
                 if self._pyo3:
-                    self._pyo3.add_doc(kwargs)
+                    self._pyo3.add_doc(text)
                     doc._pyo3 = self._pyo3
+                    ids.add(doc_id)
+                    self._cache_doc(doc)
                 else:
                     self._docs[doc_id] = doc
-                return doc
-            else:
-                raise Exception("Invalid arguments, please specify the text " +
-                                "or use correct layer names.")
+                added.append(doc)
+        finally:
+            self._docs_changed()
+        return added
+
     def update_doc(self, old_id : str, doc: Document) -> str:
         """Replace a particular document indicated by an identifier
         with a new document object.
@@ -1139,7 +1155,10 @@ class Corpus(ImmutableCorpus):
         Returns:
             The identifier of the new document.
         """
+        self._docs_changed()
         if self._pyo3:
+            self._doc_cache.pop(old_id, None)
+            self._doc_id_set = None
             new_doc_id = self._pyo3.update_doc(old_id,
                              {name: layer.raw
                                     for (name, layer) in doc.layers.items()})
@@ -1147,11 +1166,21 @@ class Corpus(ImmutableCorpus):
         else:
             if old_id in self._docs:
                 del self._docs[old_id]
-            doc_id = teanga_id_for_doc(self.doc_ids,
+            doc_id = teanga_id_for_doc(self._known_ids(),
                                        **doc.character_layers())
             self._docs[doc_id] = doc
             return doc_id
 
+    def _known_ids(self):
+        """Return the document ids as a container with fast membership
+        tests, used to choose the id of a new document"""
+        if self._pyo3:
+            if self._doc_id_set is None:
+                self._doc_id_set = set(self._pyo3.order)
+            return self._doc_id_set
+        else:
+            return self._docs.keys()
+
     @property
     def doc_ids(self) -> Iterable[str]:
         """Return the document ids of the corpus.
@@ -1180,12 +1209,20 @@ class Corpus(ImmutableCorpus):
         """
         if self._pyo3:
             for doc_id in self._pyo3.order:
-                yield Document(self.meta, id=doc_id, _pyo3=self._pyo3,
-                               corpus_ref=self,
-                               **self._pyo3.get_doc_by_id(doc_id))
+                yield self.doc_by_id(doc_id)
+        else:
+            yield from self._docs.values()
+
+    def raw_docs(self) -> Iterator[Tuple[str, dict]]:
+        """Get the raw data of all the documents in the corpus. See
+        ImmutableCorpus.raw_docs for more information."""
+        if self._pyo3:
+            for doc_id in self._pyo3.order:
+                yield doc_id, self._pyo3.get_doc_by_id(doc_id)
         else:
-            for doc in self._docs.items():
-                yield doc[1]
+            prefixed = {}
+            for doc_id, doc in self._docs.items():
+                yield doc_id, _raw_doc(doc, prefixed)
 
     def doc_by_id(self, doc_id:str) -> Document:
         """
@@ -1207,15 +1244,27 @@ class Corpus(ImmutableCorpus):
             ...   doc = corpus.add_doc("This is a document.")
         """
         if self._pyo3:
-            return Document(self.meta, id=doc_id, _pyo3=self._pyo3,
-                            corpus_ref=self,
-                            **self._pyo3.get_doc_by_id(doc_id))
+            if doc_id in self._doc_cache:
+                self._doc_cache.move_to_end(doc_id)
+                return self._doc_cache[doc_id]
+            return self._cache_doc(Document(self.meta, id=doc_id,
+                                            _pyo3=self._pyo3, corpus_ref=self,
+                                            **self._pyo3.get_doc_by_id(doc_id)))
         else:
             if doc_id in self._docs:
                 return self._docs[doc_id]
             else:
                 raise Exception("Document with id " + doc_id + " not found.")
 
+    def _cache_doc(self, doc: Document) -> Document:
+        """Remember a document of a DB-backed corpus, evicting the least
+        recently used document if the cache is full."""
+        self._doc_cache[doc.id] = doc
+        self._doc_cache.move_to_end(doc.id)
+        if len(self._doc_cache) > DOC_CACHE_SIZE:
+            self._doc_cache.popitem(last=False)
+        return doc
+
     @property
     def meta(self) -> dict[str, LayerDesc]:
         """Return the meta data of the corpus.
@@ -1227,18 +1276,21 @@ class Corpus(ImmutableCorpus):
             {'text': LayerDesc(layer_type='characters', base=None, data=None, link_types=None, target=None, default=None, meta={})}
         """
         if self._pyo3:
-            return {
+            if self._pyo3_meta is None:
+                self._pyo3_meta = {
                     key: LayerDesc(layer_type=layer.layer_type, base=layer.base,
                                   data=layer.data, link_types=layer.link_types,
                                   target=layer.target, default=layer.default,
                                   meta=layer.meta)
                     for key, layer in self._pyo3.meta.items() }
+            return self._pyo3_meta
         else:
             return self._meta
 
     @meta.setter
     def meta(self, meta: dict[str, LayerDesc]):
         if self._pyo3:
+            teanga_pyo3 = _teanga_pyo3()
             meta_mapped = {}
             for k, v in meta.items():
                 if isinstance(v, LayerDesc):
@@ -1252,6 +1304,21 @@ class Corpus(ImmutableCorpus):
             self._pyo3.meta = meta_mapped
         else:
             self._meta = meta
+        self._meta_changed()
+
+    def _meta_changed(self):
+        """Drop everything cached from the layer metadata. Cached documents
+        of a DB-backed corpus hold a copy of the metadata, so they go too, as
+        does the metadata converted from the database"""
+        self._doc_cache.clear()
+        self._pyo3_meta = None
+        self._search_index.clear()
+
+    def _char_layer_set(self) -> frozenset:
+        """Return the names of the character layers as a set, to check the
+        layers given to add_doc. The layer metadata is public and can be
+        changed in place, so this is not cached"""
+        return frozenset(self._char_layers())
 
 
     def search(self, query=None, **kwargs) -> Iterator[str]:
@@ -1334,9 +1401,65 @@ class Corpus(ImmutableCorpus):
                 query = self.normalise_query(query)
             for result in self._pyo3.search(query):
                 yield result
+        elif kwargs:
+            for result in self._search_layers(kwargs):
+                yield result
         else:
-            for result in super().search(query, **kwargs):
+            for result in super().search(query):
                 yield result
+
+    def _search_layers(self, conditions: dict) -> Iterator[str]:
+        """Find the documents matching the keyword conditions of `search`.
+        Conditions on layers with a fixed list of values are answered from
+        an index, the others are tested on the remaining documents"""
+        candidates = None
+        rest = {}
+        for layer, value in conditions.items():
+            index = self._value_index(layer, value)
+            if index is None:
+                rest[layer] = value
+                continue
+            if isinstance(value, str):
+                doc_ids = index.get(value, set())
+            else:
+                doc_ids = set().union(*(index.get(v, ()) for v in value))
+            candidates = doc_ids if candidates is None else candidates & doc_ids
+        if candidates is None:
+            docs = self._docs.values()
+        else:
+            docs = (doc for doc_id, doc in self._docs.items()
+                    if doc_id in candidates)
+        return _layer_matches(docs, self.meta, rest)
+
+    def _value_index(self, layer: str, value) -> Optional[dict]:
+        """Return the index from the values of a layer to the ids of the
+        documents that contain them, building it again if the documents no
+        longer have the values it was built from. Returns None if the layer
+        or the condition cannot be answered from an index"""
+        if not (isinstance(value, str) or (isinstance(value, list)
+                and all(isinstance(v, str) for v in value))):
+            return None
+        desc = self.meta.get(layer)
+        if desc is None or not isinstance(desc.data, list):
+            return None
+        cached = self._search_index.get(layer)
+        if cached is None or not _index_current(self._docs, layer, cached[1]):
+            cached = self._search_index[layer] = _build_value_index(
+                    self._docs, layer)
+        return cached[0]
+
+    def _doc_order(self) -> list[str]:
+        """Return the document ids in order, reusing the list until a
+        document is added or replaced"""
+        if self._order_cache is None:
+            self._order_cache = list(self.doc_ids)
+        return self._order_cache
+
+    def _docs_changed(self):
+        """Drop the document order and search indexes after a document is
+        added or replaced"""
+        self._order_cache = None
+        self._search_index.clear()
                 
     def to_yaml(self, path_or_buf : str):
         """Write the corpus to a yaml file.
@@ -1348,9 +1471,9 @@ class Corpus(ImmutableCorpus):
         """
         if self._pyo3:
             if isinstance(path_or_buf, str):
-                teanga_pyo3.write_corpus_to_yaml(self._pyo3, path_or_buf)
+                _teanga_pyo3().write_corpus_to_yaml(self._pyo3, path_or_buf)
             else:
-                yaml_str = teanga_pyo3.write_corpus_to_yaml_string(self._pyo3)
+                yaml_str = _teanga_pyo3().write_corpus_to_yaml_string(self._pyo3)
                 path_or_buf.write(yaml_str)
         else:
             super().to_yaml(path_or_buf)
@@ -1368,7 +1491,7 @@ class Corpus(ImmutableCorpus):
 Kjco:\\n    text: This is a document.\\n'
         """
         if self._pyo3:
-            return teanga_pyo3.write_corpus_to_yaml_string(self._pyo3)
+            return _teanga_pyo3().write_corpus_to_yaml_string(self._pyo3)
         else:
             return super().to_yaml_str()
 
@@ -1382,9 +1505,9 @@ Kjco:\\n    text: This is a document.\\n'
         """
         if self._pyo3:
             if isinstance(path_or_buf, str):
-                teanga_pyo3.write_corpus_to_json(self._pyo3, path_or_buf)
+                _teanga_pyo3().write_corpus_to_json(self._pyo3, path_or_buf)
             else:
-                json_str = teanga_pyo3.write_corpus_to_json_string(self._pyo3)
+                json_str = _teanga_pyo3().write_corpus_to_json_string(self._pyo3)
                 path_or_buf.write(json_str)
         else:
             super().to_json(path_or_buf)
@@ -1401,7 +1524,7 @@ Kjco:\\n    text: This is a document.\\n'
             '{"_meta": {"text": {"type": "characters"}}, "_order": ["Kjco"], "Kjco": {"text": "This is a document."}}'
          """
         if self._pyo3:
-            return teanga_pyo3.write_corpus_to_json_string(self._pyo3)
+            return _teanga_pyo3().write_corpus_to_json_string(self._pyo3)
         else:
             return super().to_json_str()
 
@@ -1413,15 +1536,22 @@ Kjco:\\n    text: This is a document.\\n'
                 The path to the Cuac file.
         """
         if self._pyo3:
-            teanga_pyo3.write_corpus_to_cuac(self._pyo3, path)
+            _teanga_pyo3().write_corpus_to_cuac(self._pyo3, path)
         else:
             return super().to_cuac(path)
 
-    def apply(self, service : Service):
+    def apply(self, service : Service, concurrency : int = 1,
+              batch_size : int = 32):
         """Apply a service to each document in the corpus.
 
         Args:
             service: The service to apply.
+            concurrency: The number of documents processed at the same time.
+                Values above one run the service in a thread pool, which
+                helps services that wait on I/O such as a `RESTService`.
+            batch_size: The number of documents handed to the thread pool at
+                a time, when `concurrency` is above one. Must be at least
+                one.
 
         Examples:
             >>> corpus = Corpus()
@@ -1439,25 +1569,181 @@ Kjco:\\n    text: This is a document.\\n'
             ...         return input
             >>> corpus.apply(FirstCharService())
         """
+        if batch_size < 1:
+            raise ValueError("Batch size must be at least 1.")
         self.add_meta_from_service(service)
-        for doc in self.docs:
-            service.execute(doc)
+        if concurrency <= 1:
+            for doc in self.docs:
+                service.execute(doc)
+            return
+        docs = iter(self.docs)
+        with ThreadPoolExecutor(concurrency) as executor:
+            while batch := list(islice(docs, batch_size)):
+                for _ in executor.map(service.execute, batch):
+                    pass
 
     def __eq__(self, other):
         """
         Compare two Teanga Corpora for equality
         """
+        if self is other:
+            return True
         if not isinstance(other, Corpus):
             return False
-        if self.doc_ids != other.doc_ids:
+        if list(self.doc_ids) != list(other.doc_ids):
             return False
-        return all(self.doc_by_id(doc_id) == other.doc_by_id(doc_id)
-                   for doc_id in self.doc_ids)
+        return all(raw == other_raw for (_, raw), (_, other_raw)
+                   in zip(self.raw_docs(), other.raw_docs()))
+
+def _selectivity(desc: Optional[LayerDesc], value) -> float:
+    """Estimate the fraction of documents matching a search condition on a
+    layer, so that the most selective conditions can be tested first"""
+    if desc is None:
+        return 1.0
+    if isinstance(value, dict):
+        if "$regex" in value or "$text_regex" in value:
+            return 1.0
+        return 0.5
+    if desc.layer_type == "characters":
+        return 0.0
+    n = len(value) if isinstance(value, list) else 1
+    if isinstance(desc.data, list) and desc.data:
+        return min(1.0, n / len(desc.data))
+    return min(1.0, n * 0.01)
+
+def _layer_matches(docs: Iterable[Document], meta: dict,
+                   conditions: dict) -> Iterator[str]:
+    """Yield the ids of the documents that match all the layer conditions
+    given as keyword arguments to `search`"""
+    conditions = sorted(conditions.items(),
+            key=lambda kv: _selectivity(meta.get(kv[0]), kv[1]))
+    for doc in docs:
+        for layer, value in conditions:
+            if next(iter(doc[layer].matches(value)), None) is None:
+                break
+        else:
+            yield doc.id
+
+def _layer_values(doc: Document, layer: str) -> Optional[list]:
+    """Return the data of a layer of a document, or None if it has no such
+    layer"""
+    layer_obj = doc.layers.get(layer)
+    return None if layer_obj is None else layer_obj.data
+
+def _build_value_index(docs: dict, layer: str) -> Tuple[dict, dict]:
+    """Map each value of a layer to the ids of the documents that contain
+    it. A copy of each document's values is returned as well, to check the
+    index against later"""
+    index = {}
+    values = {}
+    for doc_id, doc in docs.items():
+        data = _layer_values(doc, layer)
+        if data is not None:
+            data = list(data)
+            for val in data:
+                index.setdefault(val, set()).add(doc_id)
+        values[doc_id] = data
+    return index, values
+
+def _index_current(docs: dict, layer: str, values: dict) -> bool:
+    """Check that the documents still have the layer values an index was
+    built from. Layer data can be changed in place, or through another
+    corpus holding the same document, so no hook sees every change"""
+    return docs.keys() == values.keys() and all(
+            _layer_values(doc, layer) == values[doc_id]
+            for doc_id, doc in docs.items())
+
+def _raw_doc(doc: Document, prefixed: dict) -> dict:
+    """Return the layers and metadata of a document as they are serialized.
+    `prefixed` maps metadata names to their keys and is shared between the
+    documents of a corpus, so that each key is only built once"""
+    raw = {layer_id: layer.raw for layer_id, layer in doc.layers.items()}
+    for key, value in doc.metadata.items():
+        name = prefixed.get(key)
+        if name is None:
+            name = prefixed[key] = sys.intern("_" + key)
+        raw[name] = value
+    return raw
+
+def _reservoir_sample(items: Iterable, k: int) -> list:
+    """Choose k items at random from an iterable in a single pass, holding
+    only the chosen items in memory (Li's Algorithm L). Returns fewer than k
+    items if the iterable is shorter"""
+    import random
+    it = iter(items)
+    reservoir = list(islice(it, k))
+    if len(reservoir) == k and k > 0:
+        w = exp(log(_open_random(random)) / k)
+        while True:
+            skip = floor(log(_open_random(random)) / log1p(-w))
+            item = next(islice(it, skip, None), _END)
+            if item is _END:
+                break
+            reservoir[random.randrange(k)] = item
+            w *= exp(log(_open_random(random)) / k)
+    random.shuffle(reservoir)
+    return reservoir
+
+def _open_random(random) -> float:
+    """Return a random number strictly between 0 and 1"""
+    u = random.random()
+    while u == 0.0:
+        u = random.random()
+    return u
+
+# Marks the end of an iterator where None could be a value
+_END = object()
+
+def _freq_predicate(condition) -> Optional[Callable]:
+    """Return the test that selects the values counted by `text_freq` and
+    `val_freq` for a condition, or None if every value is counted"""
+    if condition is None:
+        return None
+    elif isinstance(condition, str):
+        return partial(eq, condition)
+    elif callable(condition):
+        return condition
+    try:
+        return frozenset(condition).__contains__
+    except TypeError:
+        return condition.__contains__
+
+# Document ids that YAML would read as numbers or booleans if left unquoted
+_YAML_INTLIKE_RE = re.compile(
+        r"^[-+]?(0b[0-1_]+|0o[0-7_]+|0x[0-9a-fA-F_]+|[0-9][0-9_]*)$")
+_YAML_BOOL_IDS = frozenset(("true", "True", "TRUE", "false", "False", "FALSE"))
+
+def _yaml_key(doc_id: str) -> str:
+    """Format a document id as the key line of its YAML entry"""
+    if doc_id in _YAML_BOOL_IDS or _YAML_INTLIKE_RE.match(doc_id):
+        return "\"" + doc_id + "\":\n"
+    return doc_id + ":\n"
+
+# Strings the dumper writes as they are: words separated by single spaces,
+# other than the words YAML 1.1 reads as booleans or null. Plain scalars with
+# spaces are folded past the line width, so those are left to the dumper
+_YAML_PLAIN_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_.\-]*(?: [A-Za-z0-9_.\-]+)*")
+_YAML_RESERVED = frozenset(
+        word
+        for base in ("null", "true", "false", "yes", "no", "on", "off")
+        for word in (base, base.capitalize(), base.upper()))
 
 def _yaml_str(s):
-    """
-    """
-    s = yaml.safe_dump(str(s))
+    """Format a value as a YAML scalar, followed by a new line. Short strings,
+    such as layer names and tags, recur across documents and are cached"""
+    s = str(s)
+    if len(s) <= YAML_STR_CACHE_LENGTH:
+        return _cached_yaml_str(s)
+    return _format_yaml_str(s)
+
+def _format_yaml_str(s : str) -> str:
+    if ((len(s) <= 80 or " " not in s) and _YAML_PLAIN_RE.fullmatch(s)
+            and s not in _YAML_RESERVED):
+        return s + "\n"
+    return _dump_yaml_str(s)
+
+def _dump_yaml_str(s : str) -> str:
+    s = _get_yaml().dump(s, Dumper=_YamlDumper)
     if s.endswith("\n...\n"):
         s = s[:-4]
     if not s.startswith("'"):
@@ -1466,25 +1752,42 @@ def _yaml_str(s):
             s = s[:-4]
     return s
 
-def _corpus_hook(dct : dict) -> Corpus:
-    """
+_cached_yaml_str = lru_cache(maxsize=4096)(_format_yaml_str)
+
+def _dump_yaml_json(obj) -> str:
+    """Format a value as a YAML line, with strings as YAML scalars and
+    anything else in the JSON flow style"""
+    if obj is None:
+        return "null\n"
+    elif isinstance(obj, str):
+        return _yaml_str(obj)
+    else:
+        return _json_dumps(obj) + "\n"
+
+def _corpus_hook(dct : dict, verify_ids : bool = True) -> Corpus:
+    """Build a corpus from the parsed top-level object of a JSON or YAML
+    file. Objects without a `_meta` section are returned unchanged
     """
     c = Corpus()
     if "_meta" not in dct:
         return dct
-    c.meta = {key: _layer_desc_from_kwargs(value)
-              for key, value in dct["_meta"].items()
-              if not key.startswith("_")}
+    meta = {sys.intern(key): _layer_desc_from_kwargs(value)
+            for key, value in dct["_meta"].items()
+            if not key.startswith("_")}
+    c.meta = meta
     if "_order" in dct:
         for doc_id in dct["_order"]:
-            c._docs[doc_id] = Document(c.meta, id=doc_id, corpus_ref=c, **dct[doc_id])
+            c._docs[doc_id] = Document(meta, id=doc_id, corpus_ref=c, **dct[doc_id])
     else:
         for doc_id, value in dct.items():
             if isinstance(doc_id, int):
                 raise Exception(f"Document IDs must be escaped if they can be interpreted as integers."
                 + f"Found: {doc_id}, may occur in document as Ox{doc_id:02x} or Oo{doc_id:02o} or +{doc_id:03}")
             if not doc_id.startswith("_"):
-                doc = Document(c.meta, id=doc_id, corpus_ref=c, **value)
+                doc = Document(meta, id=doc_id, corpus_ref=c, **value)
+                if not verify_ids:
+                    c._docs[doc_id] = doc
+                    continue
                 text_fields = {
                         field: value for field, value in value.items()
                         if isinstance(value, str) and not field.startswith("_")
@@ -1498,7 +1801,8 @@ def _corpus_hook(dct : dict) -> Corpus:
                 c._docs[doc_id] = doc
     return c
 
-def read_json_str(json_str:str, db_file:str=None) -> Corpus:
+def read_json_str(json_str:str, db_file:str=None,
+                  verify_ids:bool=True) -> Corpus:
     """Read a corpus from a json string.
 
     Args:
@@ -1507,20 +1811,22 @@ def read_json_str(json_str:str, db_file:str=None) -> Corpus:
         db_file: str
             The path to the database file, if the corpus should be stored in a
             database.
+        verify_ids: bool
+            Whether to check that the document ids match the text of the
+            documents. This can be disabled for trusted files.
 
     Examples:
         >>> corpus = read_json_str('{"_meta": {"text": {"type": \
     "characters"}},"Kjco": {"text": "This is a document."}}')
     """
     if db_file:
-        if not TEANGA_PYO3:
-            teanga_db_fail()
-        return Corpus(db_corpus=teanga_pyo3.read_corpus_from_json_string(
+        return Corpus(db_corpus=_teanga_pyo3().read_corpus_from_json_string(
             json_str, db_file))
     else:
-        return json.loads(json_str, object_hook=_corpus_hook)
+        return _corpus_hook(_json_loads(json_str), verify_ids)
 
-def read_json(path_or_buf, db_file:str=None) -> Corpus:
+def read_json(path_or_buf, db_file:str=None,
+              verify_ids:bool=True) -> Corpus:
     """Read a corpus from a json file.
 
     Args:
@@ -1529,16 +1835,18 @@ def read_json(path_or_buf, db_file:str=None) -> Corpus:
         db_file: str
             The path to the database file, if the corpus should be stored in a
             database.
+        verify_ids: bool
+            Whether to check that the document ids match the text of the
+            documents. This can be disabled for trusted files.
     """
     if db_file:
-        if not TEANGA_PYO3:
-            teanga_db_fail()
-        return Corpus(db_corpus=teanga_pyo3.read_corpus_from_json_file(
+        return Corpus(db_corpus=_teanga_pyo3().read_corpus_from_json_file(
             path_or_buf, db_file))
     else:
-        return json.load(path_or_buf, object_hook=_corpus_hook)
+        return _corpus_hook(_json_loads(path_or_buf.read()), verify_ids)
 
-def read_yaml(path_or_buf, db_file:str=None) -> Corpus:
+def read_yaml(path_or_buf, db_file:str=None,
+              verify_ids:bool=True) -> Corpus:
     """Read a corpus from a yaml file.
 
     Args:
@@ -1547,18 +1855,35 @@ def read_yaml(path_or_buf, db_file:str=None) -> Corpus:
         db_file: str
             The path to the database file, if the corpus should be stored in a
             database.
+        verify_ids: bool
+            Whether to check that the document ids match the text of the
+            documents. This can be disabled for trusted files.
     """
     if db_file:
-        if not TEANGA_PYO3:
-            teanga_db_fail()
-        return Corpus(db_corpus=teanga_pyo3.read_corpus_from_yaml_file(
+        return Corpus(db_corpus=_teanga_pyo3().read_corpus_from_yaml_file(
             path_or_buf, db_file))
 
+    elif os.path.getsize(path_or_buf) > YAML_STREAM_THRESHOLD:
+        return _read_yaml_stream(path_or_buf, verify_ids)
     else:
-        with open(path_or_buf) as f:
-            return _corpus_hook(yaml.load(f, Loader=YamlLoader))
+        with open(path_or_buf, "rb") as f:
+            return _corpus_hook(_yaml_load(f), verify_ids)
+
+def _read_yaml_stream(path:str, verify_ids:bool) -> Corpus:
+    """Read a YAML file one document at a time, so that the YAML tree of
+    the whole file is never held in memory"""
+    from .stream import CorpusStream
+    corpus = Corpus()
+    with open(path, "rb") as f:
+        stream = CorpusStream(f, verify_ids)
+        corpus.meta = stream.meta
+        for doc in stream:
+            doc._corpus_ref = corpus
+            corpus._docs[doc.id] = doc
+    return corpus
 
-def read_yaml_str(yaml_str, db_file:str=None) -> Corpus:
+def read_yaml_str(yaml_str, db_file:str=None,
+                  verify_ids:bool=True) -> Corpus:
     """Read a corpus from a yaml string.
 
     Args:
@@ -1567,6 +1892,9 @@ def read_yaml_str(yaml_str, db_file:str=None) -> Corpus:
         db_file: str
             The path to the database file, if the corpus should be stored in a
             database.
+        verify_ids: bool
+            Whether to check that the document ids match the text of the
+            documents. This can be disabled for trusted files.
 
     Examples:
         >>> yaml_str = '''_meta:
@@ -1577,20 +1905,20 @@ def read_yaml_str(yaml_str, db_file:str=None) -> Corpus:
         >>> corpus = read_yaml_str(yaml_str)
     """
     if db_file:
-        if not TEANGA_PYO3:
-            teanga_db_fail()
-        return Corpus(db_corpus=teanga_pyo3.read_corpus_from_yaml_string(
+        return Corpus(db_corpus=_teanga_pyo3().read_corpus_from_yaml_string(
             yaml_str, db_file))
     else:
-        return _corpus_hook(yaml.load(yaml_str, Loader=YamlLoader))
+        return _corpus_hook(_yaml_load(yaml_str), verify_ids)
     
-def parse(path_or_buf:str) -> CorpusStream:
+def parse(path_or_buf:str, format:str="yaml") -> 'CorpusStream':
     """Parse a corpus incrementally from a file or buffer. Note that you will need
     to load this into a Corpus object directly
 
     Args:
         path_or_buf: str
             The path to the file or a buffer.
+        format: str
+            The format of the file, either "yaml" or "json".
 
     Examples:
         >>> import io
@@ -1601,13 +1929,15 @@ def parse(path_or_buf:str) -> CorpusStream:
         ...   text: This is a document.'''
         >>> stream = parse(io.StringIO(yaml_str))
         >>> corpus = Corpus()
-        >>> corpus._meta = stream.meta
+        >>> corpus.meta = stream.meta
         >>> for doc in stream:
         ...     _ = corpus.add_doc(doc)
     """
-    return CorpusStream(path_or_buf)
+    from .stream import CorpusStream
+    return CorpusStream(path_or_buf, format=format)
 
-def from_url(url:str, db_file:str=None) -> Corpus:
+def from_url(url:str, db_file:str=None,
+             verify_ids:bool=True) -> Corpus:
     """Read a corpus from a URL.
 
     Args:
@@ -1616,19 +1946,23 @@ def from_url(url:str, db_file:str=None) -> Corpus:
         db_file: str
             The path to the database file, if the corpus should be stored in a
             database.
+        verify_ids: bool
+            Whether to check that the document ids match the text of the
+            documents. This can be disabled for trusted files.
     """
     if db_file:
-        if not TEANGA_PYO3:
-            teanga_db_fail()
-        return Corpus(db_corpus=teanga_pyo3.read_corpus_from_yaml_url(
+        return Corpus(db_corpus=_teanga_pyo3().read_corpus_from_yaml_url(
             url, db_file))
     else:
-        if url.endswith(".gz"):
-            with gzip.open(urlopen(url), "rt") as f:
-                return _corpus_hook(yaml.load(f, Loader=YamlLoader))
-        else:
-            with urlopen(url) as f:
-                return _corpus_hook(yaml.load(f, Loader=YamlLoader))
+        # Asking for a compressed transfer is cheap for YAML. The body is
+        # read whole and unpacked in one call, whether it was compressed for
+        # the transfer, stored as a .gz file, or both
+        request = Request(url, headers={"Accept-Encoding": "gzip"})
+        with urlopen(request) as response:
+            data = response.read()
+        while data[:2] == GZIP_MAGIC:
+            data = gzip.decompress(data)
+        return _corpus_hook(_yaml_load(data), verify_ids)
 
 DOWNLOAD_URLS = [
         "https://teanga.io/corpora/",
@@ -1717,8 +2051,7 @@ def read_cuac(file:str, db_file:str=None) -> Corpus:
             The path to the database file, if the corpus should be stored in a
             database.
     """
-    if not TEANGA_PYO3:
-        teanga_db_fail()
+    teanga_pyo3 = _teanga_pyo3()
     if not db_file:
         db_file = tempfile.mkdtemp()
     return Corpus(db_corpus=teanga_pyo3.read_corpus_from_cuac_file(file, db_file))
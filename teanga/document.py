@@ -3,15 +3,18 @@ from abc import ABC, abstractmethod
 from typing import Generator
 import numbers
 from itertools import chain, pairwise
+from functools import lru_cache
 from deprecated import deprecated
 from typing import Union, Tuple, Iterator
-from .layer_desc import LayerDesc
+from .layer_desc import LayerDesc, _VALID_LAYER_TYPES
 import regex as re
 
 class Document:
     """Document class for storing and processing text data.
 
     """
+    __slots__ = ("layers", "_meta", "_pyo3", "id", "_metadata", "_corpus_ref")
+
     def __init__(self, meta:dict[str,Union[LayerDesc,dict]],
                  _pyo3=None, id=None, corpus_ref=None, **kwargs):
         self._meta = meta
@@ -80,7 +83,7 @@ class Document:
             return value
         if self._meta[name].layer_type is None:
             raise Exception("Layer " + name + " has no layer type.")
-        if self._meta[name].layer_type not in ["characters", "seq", "span", "div", "element"]:
+        if self._meta[name].layer_type not in _VALID_LAYER_TYPES:
             raise Exception("Invalid layer type " + self._meta[name].layer_type)
         if self._meta[name].layer_type == "characters":
             if self.id and not self._corpus_ref:
@@ -134,12 +137,15 @@ class Document:
             raise Exception("Unknown layer type " + self._meta[name].layer_type +
             " for layer " + name + ".")
         if self._pyo3 and self.id:
-            data_fields = {name: layer.raw
-                           for (name,layer) in self.layers.items()}
-            self._pyo3.update_doc(self.id, data_fields)
+            self._write_to_db()
 
         return self.layers[name]
 
+    def _write_to_db(self):
+        """Write the layers of a DB-backed document back to the database"""
+        self._pyo3.update_doc(self.id, {name: layer.raw
+                                        for name, layer in self.layers.items()})
+
     def __getattr__(self, name:str) -> 'Layer':
         """Return the layer with the given name."""
         if name.startswith("_"):
@@ -176,25 +182,41 @@ class Document:
             >>> doc.add_layers({"words": [(0,4), (5,7), (8,9), (10,18), (18,19)], \
     "pos": ["DT", "VBZ", "DT", "NN", "."]})
             """
+        meta = self._meta
         added = set(self.layers.keys())
-        to_add = set(layers.keys())
-
-        for layer in self._meta:
-            if layer not in layers and self._meta[layer].default is not None:
+        for layer, desc in meta.items():
+            if layer not in layers and desc.default is not None:
                 added.add(layer)
 
-        while len(to_add) > 0:
-            for name in to_add.copy():
-                data = layers[name]
-                if self._meta[name].base is None or self._meta[name].base in added:
-                    self[name] = data
-                    added.add(name)
-                    to_add.remove(name)
-                elif (self._meta[name].base is not None
-                      and self._meta[name].base not in layers
-                      and self._meta[name].base not in added):
-                    raise Exception("Cannot add layer " + name + " because sublayer " +
-                    self._meta[name].base + " does not exist.")
+        # Add each layer once its sublayer is there, in the order given
+        order = []
+        dependents = {}
+        for name in layers:
+            base = meta[name].base
+            if base is None or base in added:
+                order.append(name)
+            elif base in layers:
+                dependents.setdefault(base, []).append(name)
+            else:
+                raise Exception("Cannot add layer " + name + " because sublayer " +
+                base + " does not exist.")
+        for name in order:
+            order.extend(dependents.pop(name, ()))
+        if dependents:
+            ordered = set(order)
+            raise Exception("Layers " +
+                ", ".join(name for name in layers if name not in ordered) +
+                " have cyclic sublayers.")
+        # Setting a layer writes a DB-backed document back to the database, so
+        # that is held off until all the layers are set
+        pyo3, self._pyo3 = self._pyo3, None
+        try:
+            for name in order:
+                self[name] = layers[name]
+        finally:
+            self._pyo3 = pyo3
+            if pyo3 and self.id:
+                self._write_to_db()
 
     def __getitem__(self, name:str):
         """Return the value of a layer.
@@ -223,9 +245,10 @@ class Document:
 
     def character_layers(self) -> dict[str, str]:
         """Get the character layers for this document (used to calculate the ID)"""
-        return {layer: self.layers[layer].raw
-                for layer in self.layers
-                if self._meta[layer].layer_type == "characters"}
+        meta = self._meta
+        return {name: layer.raw
+                for name, layer in self.layers.items()
+                if meta[name].layer_type == "characters"}
 
     @property
     def meta(self):
@@ -349,8 +372,8 @@ class Document:
 
     def to_json(self) -> str:
         """Return the JSON representation of the document."""
-        return {layer_id: self.layers[layer_id].raw
-                for layer_id in self.layers.keys()}
+        return {layer_id: layer.raw
+                for layer_id, layer in self.layers.items()}
 
     @staticmethod
     def from_json(json:dict, meta:dict, _pyo3=None, id=None) -> 'Document':
@@ -404,6 +427,11 @@ def clip_string(s):
     else:
         return s
 
+def _is_int(value) -> bool:
+    """Return whether a value is an integer. Plain ints are checked first, as
+    checking against the abstract class is many times slower"""
+    return type(value) is int or isinstance(value, numbers.Integral)
+
 def validate_value(value, index_length):
     """Validate a single value in a layer and normalise it if necessary.
 
@@ -415,20 +443,20 @@ def validate_value(value, index_length):
     if not isinstance(value, list):
         if index_length >= 2:
             raise Exception("Bad value: " + repr(value))
-        if index_length == 1 and not isinstance(value, numbers.Integral):
+        if index_length == 1 and not _is_int(value):
             raise Exception("Bad value: " + repr(value))
         if (index_length == 0 and not isinstance(value, str) and
-            not isinstance(value, numbers.Integral)):
+            not _is_int(value)):
             raise Exception("Bad value: " + repr(value))
         return value
     else:
         if index_length > 0:
             for i in range(index_length):
-                if not isinstance(value[i], numbers.Integral):
+                if not _is_int(value[i]):
                     raise Exception("Bad value: " + repr(value))
         if len(value) == 1:
             if (not isinstance(value[0], str)
-                and not isinstance(value[0], numbers.Integral)):
+                and not _is_int(value[0])):
                 raise Exception("Bad value: " + repr(value))
             return value[0]
         elif len(value) == index_length:
@@ -436,17 +464,21 @@ def validate_value(value, index_length):
         elif len(value) == index_length + 1:
             import sys
             if (not isinstance(value[index_length], str)
-                    and not isinstance(value[index_length], numbers.Integral)):
+                    and not _is_int(value[index_length])):
                 raise Exception("Bad value: " + repr(value))
             return value
         elif len(value) == index_length + 2:
-            if (not isinstance(value[index_length], numbers.Integral)
+            if (not _is_int(value[index_length])
                     or not isinstance(value[index_length + 1], str)):
                 raise Exception("Bad value: " + repr(value))
             return value
         else:
             raise Exception("Bad value: " + repr(value))
 
+# Search patterns are tested against every annotation, so they are compiled
+# once instead of going through the regex module's own cache on every match
+_compile_regex = lru_cache(maxsize=256)(re.compile)
+
 def _key_match(data, text, key, match) -> bool:
     if key == "$text":
         return text == match
@@ -473,9 +505,9 @@ def _key_match(data, text, key, match) -> bool:
     elif key == "$text_nin":
         return text not in match
     elif key == "$regex":
-        return re.match(match, data)
+        return _compile_regex(match).match(data)
     elif key == "$text_regex":
-        return re.match(match, text)
+        return _compile_regex(match).match(text)
     elif key in ["$exists", "$and", "$or", "$not"]:
         raise Exception("Operator " + key + " occurs in wrong context")
     else:
@@ -579,12 +611,13 @@ class DataLayer(Layer):
             else:
                 return (i for i, x in enumerate(self.data) if x in value)
         elif isinstance(value, dict):
+            conditions = tuple(value.items())
             if any(k.startswith("$text") for k in value):
                 return (i for i, (d, t) in enumerate(zip(self.data, self.text))
-                        if all(_key_match(d, t, k, v) for k, v in value.items()))
+                        if all(_key_match(d, t, k, v) for k, v in conditions))
             else:
                 return (i for i, d in enumerate(self.data)
-                        if all(_key_match(d, None, k, v) for k, v in value.items()))
+                        if all(_key_match(d, None, k, v) for k, v in conditions))
         else:
             raise Exception("Bad value: " + repr(value))
 
@@ -786,9 +819,9 @@ class SpanLayer(StandoffLayer):
         super().__init__(name, doc)
         self._data = spans
         for span in self._data:
-            if not isinstance(span[0], numbers.Integral):
+            if not _is_int(span[0]):
                 raise Exception("Bad span data: " + repr(span))
-            if not isinstance(span[1], numbers.Integral):
+            if not _is_int(span[1]):
                 raise Exception("Bad span data: " + repr(span))
 
     @property
@@ -843,7 +876,7 @@ class SpanLayer(StandoffLayer):
         return SpanLayer(self._name, self._doc, [transform_func(x) for x in self._data])
 
 def _1st_idx(d):
-    if isinstance(d, numbers.Integral):
+    if _is_int(d):
         return d
     else:
         return d[0]
@@ -857,8 +890,8 @@ class DivLayer(StandoffLayer):
         super().__init__(name, doc)
         self._data = spans
         for span in self._data:
-            if (not isinstance(span, numbers.Integral) and
-                not isinstance(span[0], numbers.Integral)):
+            if (not _is_int(span) and
+                not _is_int(span[0])):
                 raise Exception("Bad span data: " + repr(span))
 
     @property
@@ -920,11 +953,11 @@ class ElementLayer(StandoffLayer):
 
     def __init__(self, name:str, doc: Document, spans:list):
         super().__init__(name, doc)
-        if len(spans) > 0 and any(isinstance(s,numbers.Integral) for s in spans):
+        if len(spans) > 0 and any(_is_int(s) for s in spans):
             spans = [(s,) for s in spans]
         self._data = spans
         for span in self._data:
-            if not isinstance(span[0], numbers.Integral):
+            if not _is_int(span[0]):
                 raise Exception("Bad span data: " + repr(span))
 
     @property
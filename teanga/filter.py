@@ -15,7 +15,8 @@ class SubsetCorpus(ImmutableCorpus):
             subset: A list of document IDs to include in the subset.
         """
         self._corpus = corpus
-        self._subset = subset
+        # Keeps the order of the subset with constant time membership tests
+        self._subset = dict.fromkeys(subset)
 
     @property
     def doc_ids(self) -> Iterator[str]:
@@ -52,13 +53,17 @@ class FilterCorpus(ImmutableCorpus):
     def doc_ids(self) -> Iterator[str]:
         """Return an iterator over the document IDs that match the filter."""
         if self._subset is None:
-            self._subset = [doc_id for doc_id in self._corpus.doc_ids if self._filter_func(self._corpus.doc_by_id(doc_id))]
+            self._subset = dict.fromkeys(doc_id for doc_id in self._corpus.doc_ids if self._filter_func(self._corpus.doc_by_id(doc_id)))
         return iter(self._subset)   
 
     def doc_by_id(self, doc_id: str) -> 'Document':
         """Return a document by its ID if it matches the filter."""
-        if ((self._subset is None and not self._filter_func(self._corpus.doc_by_id(doc_id))) or
-            doc_id not in self._subset):
+        if self._subset is None:
+            doc = self._corpus.doc_by_id(doc_id)
+            if not self._filter_func(doc):
+                raise KeyError(f"Document ID {doc_id} does not match the filter.")
+            return doc
+        if doc_id not in self._subset:
             raise KeyError(f"Document ID {doc_id} does not match the filter.")
         return self._corpus.doc_by_id(doc_id)
     
@@ -1,32 +1,46 @@
 from collections import namedtuple
 
-LayerDesc = namedtuple("LayerDesc",
-                       ["layer_type", "base", "data",
-                        "link_types", "target", "default", "meta"],
-                       defaults=[None, None, None, None, None, None, {}])
+class LayerDesc(namedtuple("LayerDesc",
+                           ["layer_type", "base", "data",
+                            "link_types", "target", "default", "meta"])):
+    """The description of a layer in the metadata of a corpus"""
+    __slots__ = ()
+
+    def __new__(cls, layer_type=None, base=None, data=None, link_types=None,
+                target=None, default=None, meta=None):
+        # Each description gets its own metadata dictionary
+        return tuple.__new__(cls, (layer_type, base, data, link_types,
+                                   target, default,
+                                   {} if meta is None else meta))
+
+# The types a layer can have
+_VALID_LAYER_TYPES = frozenset(("characters", "span", "seq", "div", "element"))
+
+# The fields written out by `_from_layer_desc`, in the order they are written
+_SERIALIZED_FIELDS = LayerDesc._fields[1:6]
+
+# The fields that can be given by name in a serialized description
+_DESC_FIELDS = frozenset(LayerDesc._fields[:6])
 
 def _layer_desc_from_kwargs(kwargs):
-    kwargs["meta"] = {}
-    if "type" in kwargs:
-        kwargs["layer_type"] = kwargs["type"]
-        del kwargs["type"]
-    kwargs2 = kwargs.copy()
-    for key in kwargs:
-        if key.startswith("_"):
-            kwargs2["meta"][key[1:]] = kwargs[key]
-            del kwargs2[key]
-        elif key not in ["layer_type", "base", "data", "link_types",
-                         "target", "default", "meta"]:
+    fields = {}
+    meta = {}
+    for key, value in kwargs.items():
+        if key == "type":
+            fields["layer_type"] = value
+        elif key.startswith("_"):
+            meta[key[1:]] = value
+        elif key in _DESC_FIELDS:
+            fields[key] = value
+        elif key != "meta":
             raise Exception("Invalid key in Teanga meta description: " + key)
-    return LayerDesc(**kwargs2)
+    return LayerDesc(meta=meta, **fields)
 
 def _from_layer_desc(layer_desc):
-    d = {
-         name: data for name,data in layer_desc._asdict().items()
-         if data is not None and name != "meta"
-    }
+    d = {name: data
+         for name, data in zip(_SERIALIZED_FIELDS, layer_desc[1:6])
+         if data is not None}
     for key, value in layer_desc.meta.items():
         d["_" + key] = value
-    d["type"] = d["layer_type"]
-    del d["layer_type"]
+    d["type"] = layer_desc.layer_type
     return d
@@ -1,5 +1,6 @@
 from abc import ABC, abstractmethod
 from .document import Document
+from .utils import _json_loads, _json_bytes
 import requests
 
 class Service(ABC):
@@ -53,8 +54,9 @@ class RESTService(Service):
 
     def execute(self, input:Document):
         """Executes this service on a document."""
-        r = requests.post(self.endpoint, json=input.to_json())
-        return input.add_layers(r.json())
+        r = requests.post(self.endpoint, data=_json_bytes(input.to_json()),
+                          headers={"Content-Type": "application/json"})
+        return input.add_layers(_json_loads(r.content))
 
 def rest_service(service, kwargs):
     """Start a service as a REST service."""
@@ -1,16 +1,22 @@
 import yaml
+import json
+import re
+from codecs import getincrementaldecoder
 from typing import Any, Iterator, List, Tuple
 from teanga.utils import teanga_id_for_doc
 from teanga.layer_desc import _layer_desc_from_kwargs
+from teanga.corpus import (_yaml_str, _yaml_key, _json_dumps, _dump_yaml_json,
+                           _yaml_parse)
 import teanga
-import re
-import json
 
 class CorpusStream:
-    """A stream of documents from a YAML file.
+    """A stream of documents from a YAML or JSON file.
 
     Args:
         buf: A path to a YAML file or a buffer.
+        verify_ids: Whether to check that the document ids match the text of
+            the documents.
+        format: The format of the buffer, either "yaml" or "json".
 
     Examples:
         >>> import io
@@ -23,8 +29,13 @@ class CorpusStream:
         >>> next(stream)
         Document('Kjco', {'text': 'This is a document.'})
     """
-    def __init__(self, buf):
-        self.stream = read_obj(yaml.parse(buf))
+    def __init__(self, buf, verify_ids:bool=True, format:str="yaml"):
+        if format == "json":
+            self.stream = read_json_obj(buf)
+        elif format == "yaml":
+            self.stream = read_obj(_yaml_parse(buf))
+        else:
+            raise ValueError("Unknown format: " + format)
         key, value = next(self.stream)
         if key != "_meta":
             raise ValueError(f"Expected _meta, got {key}")
@@ -32,29 +43,49 @@ class CorpusStream:
               for key, v in value.items()
               if not key.startswith("_")}
         self.doc_ids = []
-    
+        self._doc_id_set = set()
+        self._verify_ids = verify_ids
+
     def __next__(self):
         from teanga import Document
         key, value = next(self.stream)
         while key.startswith("_"):
             if key == "_order":
+                # Ids listed in an order were assigned by the writer
                 self.doc_ids = value
+                self._verify_ids = False
             key, value = next(self.stream)
         doc = Document(self.meta, id=key, **value)
-        text_fields = {
-                field: value for field, value in value.items()
-                if isinstance(value, str)
-        }
-        tid = teanga_id_for_doc(self.doc_ids, **text_fields)
-        self.doc_ids.append(key)
-        if tid != key:
-            raise Exception("Invalid document id: " + key +
-                            " should be " + tid)
+        if self._verify_ids:
+            text_fields = {
+                    field: value for field, value in value.items()
+                    if isinstance(value, str) and not field.startswith("_")
+            }
+            tid = teanga_id_for_doc(self._doc_id_set, **text_fields)
+            self.doc_ids.append(key)
+            self._doc_id_set.add(key)
+            if tid != key:
+                raise Exception("Invalid document id: " + key +
+                                " should be " + tid)
         return doc
 
     def __iter__(self):
         return self
 
+# Used to resolve and construct scalars as `yaml.safe_load` would, without
+# creating a new loader for every scalar
+_SCALAR_LOADER = yaml.SafeLoader("")
+
+def _scalar(event) -> Any:
+    """Return the value of a scalar event. Quoted scalars stay strings"""
+    tag = event.tag
+    if tag is None or tag == "!":
+        tag = _SCALAR_LOADER.resolve(yaml.ScalarNode, event.value,
+                                     event.implicit)
+    node = yaml.ScalarNode(tag, event.value, style=event.style)
+    constructors = _SCALAR_LOADER.yaml_constructors
+    return constructors.get(tag, constructors[None])(_SCALAR_LOADER, node)
+
 def read_obj(stream) -> Iterator[Tuple[str, Any]]:
     """Read an object from a YAML stream.
 
@@ -75,7 +106,7 @@ def read_obj(stream) -> Iterator[Tuple[str, Any]]:
             if isinstance(event, yaml.MappingEndEvent) or event is None:
                 break
             else:
-                key = yaml.safe_load(event.value)
+                key = _scalar(event)
                 value = read_any(stream)
                 yield key, value
         else:
@@ -96,7 +127,7 @@ def read_any(stream) -> Any:
     while isinstance(event, yaml.StreamStartEvent) or isinstance(event, yaml.DocumentStartEvent):
         event = next(stream)
     if isinstance(event, yaml.ScalarEvent):
-        return yaml.safe_load(event.value)
+        return _scalar(event)
     elif isinstance(event, yaml.SequenceStartEvent):
         return read_seq(stream)
     elif isinstance(event, yaml.MappingStartEvent):
@@ -127,7 +158,7 @@ def read_seq(stream) -> List[Any]:
         if isinstance(event, yaml.MappingStartEvent):
             elems.append(dict(read_obj2(stream)))
         elif isinstance(event, yaml.ScalarEvent):
-            elems.append(yaml.safe_load(event.value))
+            elems.append(_scalar(event))
         elif isinstance(event, yaml.SequenceStartEvent):
             elems.append(read_seq(stream))
         else:
@@ -142,83 +173,166 @@ def read_obj2(stream) -> Iterator[Tuple[str, Any]]:
     Args:
         stream: A YAML stream.
     """
-    for _ in range(100):
+    while True:
         event = next(stream)
         if isinstance(event, yaml.MappingEndEvent) or event is None:
             break
         else:
-            key = yaml.safe_load(event.value)
+            key = _scalar(event)
             value = read_any(stream)
             yield key, value
 
+# The number of characters read from a JSON file at a time
+JSON_CHUNK_SIZE = 1 << 16
+
+_JSON_DECODER = json.JSONDecoder()
+_JSON_WHITESPACE = re.compile(r"[ \t\n\r]*")
+# Characters that can continue a number, and so never follow a whole value
+_JSON_NUMBER_CHARS = frozenset("0123456789.eE+-")
+
+def read_json_obj(buf, chunk_size:int=JSON_CHUNK_SIZE) -> Iterator[Tuple[str, Any]]:
+    """Read the members of a JSON object from a file one at a time, so that
+    the whole object is never held in memory.
+
+    Args:
+        buf: A text or binary buffer holding a JSON object.
+        chunk_size: The number of characters read at a time.
+
+    Examples:
+        >>> import io
+        >>> list(read_json_obj(io.StringIO('{"a": 1, "b": [2, 3]}'), 4))
+        [('a', 1), ('b', [2, 3])]
+    """
+    reader = _JsonReader(buf, chunk_size)
+    if reader.next_char() != "{":
+        raise ValueError("Expected a JSON object")
+    if reader.peek_char() == "}":
+        return
+    while True:
+        key = reader.value()
+        if reader.next_char() != ":":
+            raise ValueError("Expected ':' after " + repr(key))
+        yield key, reader.value()
+        c = reader.next_char()
+        if c == "}":
+            return
+        if c != ",":
+            raise ValueError("Expected ',' or '}' after " + repr(key))
+
+class _JsonReader:
+    """The text of a JSON file read so far, from the current position on.
+    A value is only taken once the character after it has been read and
+    cannot continue it, so that a number cut off at the end of a chunk is
+    never taken as complete"""
+    def __init__(self, buf, chunk_size:int):
+        self.buf = buf
+        self.chunk_size = chunk_size
+        self.text = ""
+        self.pos = 0
+        self.decoder = None
+
+    def _read(self, size:int) -> bool:
+        """Add at least `size` more characters to the text, dropping what
+        has been consumed. Returns False at the end of the file"""
+        chunk = self.buf.read(size)
+        if not chunk:
+            if self.decoder is not None:
+                # Fails on a character cut off by the end of the file
+                self.decoder.decode(b"", True)
+            return False
+        if isinstance(chunk, bytes):
+            if self.decoder is None:
+                self.decoder = getincrementaldecoder("utf-8")()
+            chunk = self.decoder.decode(chunk)
+        self.text = self.text[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek_char(self) -> str:
+        """Skip whitespace and return the next character, or "" at the end"""
+        while True:
+            self.pos = _JSON_WHITESPACE.match(self.text, self.pos).end()
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self._read(self.chunk_size):
+                return ""
+
+    def next_char(self) -> str:
+        """Skip whitespace and consume the next character"""
+        c = self.peek_char()
+        self.pos += 1
+        return c
+
+    def value(self) -> Any:
+        """Decode the next value"""
+        self.peek_char()
+        while True:
+            try:
+                obj, end = _JSON_DECODER.raw_decode(self.text, self.pos)
+                error = None
+                if (end < len(self.text)
+                        and self.text[end] not in _JSON_NUMBER_CHARS):
+                    self.pos = end
+                    return obj
+            except json.JSONDecodeError as e:
+                error = e
+            # Read as much again as is held, so that a long value is not
+            # decoded once per chunk
+            if not self._read(max(self.chunk_size, len(self.text) - self.pos)):
+                if error is not None:
+                    raise error
+                self.pos = end
+                return obj
+
 class CorpusWriter:
     def __init__(self, buf, meta, order=None):
         self.buf = buf
+        # The layer names of the last document written, and in sorted order
+        self._layer_keys = None
+        self._layer_ids = None
+        self._layer_order = sorted(meta.keys())
         self.buf.write("_meta:\n")
-        for name in sorted(meta.keys()):
+        for name in self._layer_order:
             _meta = meta[name]
-            self.buf.write("    " + name + ":\n")
-            self.buf.write("        type: " + _meta.layer_type + "\n")
+            block = ["    " + name + ":\n",
+                     "        type: " + _meta.layer_type + "\n"]
             if _meta.base:
-                self.buf.write("        base: " + _yaml_str(_meta.base))
+                block.append("        base: " + _yaml_str(_meta.base))
             if _meta.data:
-                self.buf.write("        data: " +
+                block.append("        data: " +
                              _dump_yaml_json(_meta.data))
             if _meta.link_types:
-                self.buf.write("        link_types: " +
+                block.append("        link_types: " +
                              _dump_yaml_json(_meta.link_types))
             if _meta.target:
-                self.buf.write("        target: " +
+                block.append("        target: " +
                              _dump_yaml_json(_meta.target))
             if _meta.default:
-                self.buf.write("        default: " +
+                block.append("        default: " +
                              _dump_yaml_json(_meta.default))
+            self.buf.write("".join(block))
         if order:
-            self.buf.write("_order: " + self._dump_yaml_json(order) + "\n")
+            self.buf.write("_order: " + _dump_yaml_json(order))
 
     def write(self, doc : 'teanga.Document'):
-        id = doc.id
-        if re.match(r"^[0-9]+$", id):
-            self.buf.write("\"" + id + "\":\n")
-        else:
-            self.buf.write(id + ":\n")
-        for layer_id in sorted(doc.layers):
-            self.buf.write("    ")
-            if isinstance(doc[layer_id].raw, str):
-                self.buf.write(layer_id)
-                self.buf.write(": ")
-                self.buf.write(_yaml_str(doc[layer_id].raw))
+        lines = [_yaml_key(doc.id)]
+        layers = doc.layers
+        keys = tuple(layers)
+        if keys != self._layer_keys:
+            self._layer_keys = keys
+            self._layer_ids = [name for name in self._layer_order
+                               if name in layers]
+        for layer_id in self._layer_ids:
+            raw = layers[layer_id].raw
+            if isinstance(raw, str):
+                lines.append("    " + layer_id + ": " + _yaml_str(raw))
             else:
-                self.buf.write(layer_id + ": ")
-                self.buf.write(json.dumps(doc[layer_id].raw) + "\n")
+                lines.append("    " + layer_id + ": " +
+                             _json_dumps(raw) + "\n")
+        self.buf.write("".join(lines))
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
         self.buf.close()
-
-
-def _dump_yaml_json(self, obj):
-    """
-    """
-    if obj is None:
-        return "null"
-    elif isinstance(obj, str):
-        return _yaml_str(obj)
-    else:
-        return json.dumps(obj) + "\n"
-
-def _yaml_str(s):
-    """
-    """
-    s = yaml.safe_dump(s)
-    if s.endswith("\n...\n"):
-        s = s[:-4]
-    if not s.startswith("'"):
-        s = s.replace("\n", "\n    ")
-        if s.endswith("\n    "):
-            s = s[:-4]
-    return s
-
-
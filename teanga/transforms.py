@@ -94,27 +94,15 @@ class TransformedCorpus(ImmutableCorpus):
 
     def lower(self):# -> Self:
         """Lowercase all the text in the corpus. """
-        text_layers = [layer for layer in self.meta 
-                       if self.meta[layer].layer_type == "characters"]
-        new_transform = self._transform.copy()
-        for layer in text_layers:
-            if layer in self._transform:
-                new_transform[layer] = lambda x: self._transform[layer](x).lower()
-            else:
-                new_transform[layer] = lambda x: x.lower()
-        return TransformedCorpus(self, new_transform)
+        # The documents of this corpus are already transformed
+        return TransformedCorpus(self, dict.fromkeys(self._char_layers(),
+                                                     str.lower))
 
     def upper(self):# -> Self:
         """Uppercase all the text in the corpus. """
-        text_layers = [layer for layer in self.meta 
-                       if self.meta[layer].layer_type == "characters"]
-        new_transform = self._transform.copy()
-        for layer in text_layers:
-            if layer in self._transform:
-                new_transform[layer] = lambda x: self._transform[layer](x).upper()
-            else:
-                new_transform[layer] = lambda x: x.upper()
-        return TransformedCorpus(self, new_transform)
+        # The documents of this corpus are already transformed
+        return TransformedCorpus(self, dict.fromkeys(self._char_layers(),
+                                                     str.upper))
 
     def transform(self, layer: str, transform: 
                   Callable[[str], str]):# -> Self:
@@ -134,12 +122,7 @@ class TransformedCorpus(ImmutableCorpus):
             >>> list(corpus.docs)
             [Document('Kjco', {'text': 'THIS IS A '})]
         """
-        new_transform = self._transform.copy()
-        if layer in self._transform:
-            new_transform[layer] = lambda x: transform(self._transform[layer](x))
-        else:
-            new_transform[layer] = transform
-        return TransformedCorpus(self, new_transform)
+        return TransformedCorpus(self, {layer: transform})
 
 
 
@@ -1,13 +1,23 @@
 from base64 import b64encode
 from hashlib import sha256
+import json
+try:
+    import orjson
+    _json_loads = orjson.loads
+    _json_bytes = orjson.dumps
+except ImportError:
+    _json_loads = json.loads
+    def _json_bytes(obj) -> bytes:
+        return json.dumps(obj).encode("utf-8")
 
 
 def teanga_id_for_doc(ids, *args, **kwargs):
     """Return the Teanga ID for a document.
 
     Parameters:
-        ids: str
-            The IDs already generated and not to be repeated
+        ids: Container[str]
+            The IDs already generated and not to be repeated. A set or
+            dictionary view keeps the check for collisions constant time
 
         This works as the add_doc method, but returns the Teanga ID for the document.
         It is not necessary to call this method directly but instead you can use it
@@ -1,6 +1,8 @@
 import teanga
 import yaml
+import pytest
 import tempfile
+import json
 
 def test_yaml_conv_1():
     c = teanga.Corpus()
@@ -265,3 +267,335 @@ er_setting", "I-meal_type", "I-movie_type", "I-personal_info", "I-place_name", "
 # Removed due to speed issues in downloading remote resource
 #def test_download():
 #    corpus = teanga.download("qc")
+
+def test_search_first_annotation():
+    corpus = teanga.Corpus()
+    corpus.add_layer_meta("text", layer_type="characters")
+    corpus.add_layer_meta("words", layer_type="span", base="text")
+    corpus.add_layer_meta("pos", layer_type="seq", base="words", data=["NOUN", "VERB", "ADJ"])
+    doc = corpus.add_doc(text="Colorless green ideas sleep")
+    doc.words = [[0, 9], [10, 15], [16, 21], [22, 27]]
+    doc.pos = ["ADJ", "ADJ", "NOUN", "VERB"]
+    assert list(corpus.search(pos="ADJ")) == [doc.id]
+    assert list(corpus.search(text="Colorless green ideas sleep", pos="VERB")) == [doc.id]
+    assert list(corpus.search(text="Something else", pos="VERB")) == []
+
+def test_json_meta_after_add_layer():
+    corpus = teanga.Corpus()
+    corpus.add_layer_meta("text")
+    corpus.add_doc("This is a document.")
+    assert '"words"' not in corpus.to_json_str()
+    corpus.add_layer_meta("words", layer_type="span", base="text")
+    corpus2 = teanga.read_json_str(corpus.to_json_str())
+    assert corpus2.meta == corpus.meta
+
+def test_read_yaml_verify_ids():
+    yaml_str = """_meta:
+    text:
+        type: characters
+wxyz:
+    text: This is a document.
+"""
+    with pytest.raises(Exception, match="Invalid document id"):
+        teanga.read_yaml_str(yaml_str)
+    corpus = teanga.read_yaml_str(yaml_str, verify_ids=False)
+    assert list(corpus.doc_ids) == ["wxyz"]
+
+def test_read_yaml_stream(monkeypatch):
+    corpus = teanga.Corpus()
+    corpus.add_layer_meta("text")
+    corpus.add_layer_meta("words", layer_type="span", base="text")
+    doc = corpus.add_doc("1990")
+    doc.words = [[0, 4]]
+    corpus.add_doc("This is a document.")
+    with tempfile.NamedTemporaryFile(suffix=".yaml") as f:
+        corpus.to_yaml(f.name)
+        monkeypatch.setattr(teanga.corpus, "YAML_STREAM_THRESHOLD", 0)
+        corpus2 = teanga.read_yaml(f.name)
+    assert corpus2 == corpus
+    assert corpus2.meta == corpus.meta
+
+def test_add_docs():
+    corpus = teanga.text_corpus()
+    docs = corpus.add_docs(["This is a document.", "This is another document."])
+    corpus2 = teanga.text_corpus()
+    doc1 = corpus2.add_doc("This is a document.")
+    doc2 = corpus2.add_doc("This is another document.")
+    assert [doc.id for doc in docs] == [doc1.id, doc2.id]
+    assert corpus == corpus2
+
+def test_apply_concurrency():
+    class FirstCharService(teanga.Service):
+        def requires(self):
+            return {"text": {"type": "characters"}}
+        def produces(self):
+            return {"first_char": {"type": "element", "base": "text"}}
+        def execute(self, input):
+            input["first_char"] = [0]
+            return input
+    corpus = teanga.text_corpus()
+    corpus.add_docs(["Document " + str(i) for i in range(10)])
+    corpus.apply(FirstCharService(), concurrency=4, batch_size=3)
+    assert all(doc["first_char"].raw == [(0,)] for doc in corpus.docs)
+    with pytest.raises(ValueError):
+        corpus.apply(FirstCharService(), concurrency=4, batch_size=0)
+
+def test_filter_doc_by_id():
+    corpus = teanga.text_corpus()
+    docs = corpus.add_docs(["A document.", "Another document."])
+    filtered = corpus.filter(lambda doc: str(doc.text).startswith("A "))
+    assert filtered.doc_by_id(docs[0].id) == docs[0]
+    with pytest.raises(KeyError):
+        filtered.doc_by_id(docs[1].id)
+    assert list(filtered.doc_ids) == [docs[0].id]
+
+def test_writer_layer_meta():
+    corpus = teanga.Corpus()
+    corpus.add_layer_meta("text")
+    corpus.add_layer_meta("words", layer_type="span", base="text",
+                          data=["N", "V"])
+    doc = corpus.add_doc("This is a document.")
+    buf = tempfile.TemporaryFile("w+")
+    writer = teanga.stream.CorpusWriter(buf, corpus.meta, order=[doc.id])
+    writer.write(doc)
+    buf.seek(0)
+    corpus2 = teanga.read_yaml_str(buf.read())
+    buf.close()
+    assert corpus2 == corpus
+
+def test_add_meta_from_service_keeps_service_meta():
+    class TokenService(teanga.Service):
+        def __init__(self):
+            self.layers = {"words": {"type": "span", "base": "text"}}
+        def requires(self):
+            return {"text": {"type": "characters"}}
+        def produces(self):
+            return self.layers
+        def execute(self, input):
+            pass
+    service = TokenService()
+    corpus = teanga.Corpus()
+    corpus.add_meta_from_service(service)
+    assert service.layers == {"words": {"type": "span", "base": "text"}}
+    corpus2 = teanga.Corpus()
+    corpus2.add_meta_from_service(service)
+    assert corpus2.meta == corpus.meta
+
+def test_search_index_updates():
+    corpus = teanga.Corpus()
+    corpus.add_layer_meta("text")
+    corpus.add_layer_meta("words", layer_type="span", base="text")
+    corpus.add_layer_meta("pos", layer_type="seq", base="words",
+                          data=["NOUN", "VERB", "ADJ"])
+    doc = corpus.add_doc("Dogs bark.")
+    doc.words = [(0, 4), (5, 9)]
+    doc.pos = ["NOUN", "VERB"]
+    assert list(corpus.search(pos="VERB")) == [doc.id]
+    assert list(corpus.search(pos="ADJ")) == []
+    doc.pos = ["NOUN", "ADJ"]
+    assert list(corpus.search(pos="VERB")) == []
+    assert list(corpus.search(pos="ADJ")) == [doc.id]
+    doc2 = corpus.add_doc("Cats sleep.")
+    doc2.words = [(0, 4), (5, 10)]
+    doc2.pos = ["NOUN", "VERB"]
+    assert list(corpus.search(pos="NOUN")) == [doc.id, doc2.id]
+    assert list(corpus.search(pos=["VERB", "ADJ"], words="sleep")) == [doc2.id]
+
+def test_getitem_order_updates():
+    corpus = teanga.text_corpus()
+    doc1 = corpus.add_doc("This is a document.")
+    assert corpus[0] == doc1
+    doc2 = corpus.add_doc("This is another document.")
+    assert corpus[-1] == doc2
+    doc1.text = "This is a changed document."
+    assert [doc.id for doc in corpus[:]] == list(corpus.doc_ids)
+
+def test_search_query_operators():
+    corpus = teanga.Corpus()
+    corpus.add_layer_meta("text")
+    corpus.add_layer_meta("words", layer_type="span", base="text")
+    corpus.add_layer_meta("pos", layer_type="seq", base="words",
+                          data=["NOUN", "VERB", "ADJ"])
+    doc = corpus.add_doc("Dogs bark.")
+    doc.words = [(0, 4), (5, 9)]
+    doc.pos = ["NOUN", "VERB"]
+    assert list(corpus.search({"pos": "VERB"})) == [doc.id]
+    assert list(corpus.search({"pos": "ADJ"})) == []
+    assert list(corpus.search({"$not": {"pos": "ADJ"}})) == [doc.id]
+    assert list(corpus.search({"$not": {"pos": "NOUN"}})) == []
+    assert list(corpus.search({"$or": {"pos": "ADJ", "words": "bark"}})) == [doc.id]
+    assert list(corpus.search({"$exists": "pos", "pos": {"$regex": "V.*"}})) == [doc.id]
+    assert list(corpus.search({"text": {"$eq": "Dogs bark."}})) == []
+
+def test_yaml_str_reserved_words():
+    corpus = teanga.Corpus()
+    corpus.add_layer_meta("text")
+    texts = ["yes", "Null", "off", "plain words", "trailing ", "a: b",
+             " ".join(["word"] * 40)]
+    for text in texts:
+        corpus.add_doc(text)
+    corpus2 = teanga.read_yaml_str(corpus.to_yaml_str())
+    assert [doc.text.raw for doc in corpus2.docs] == texts
+
+def test_add_layer_meta_characters_meta():
+    corpus = teanga.Corpus()
+    corpus.add_layer_meta("text", meta={"lang": "en"})
+    corpus.add_layer_meta("title")
+    assert corpus.meta["text"].meta == {"lang": "en"}
+    assert corpus.meta["title"].meta == {}
+    assert corpus.meta["text"].meta is not corpus.meta["title"].meta
+
+def test_corpus_eq():
+    corpus = teanga.text_corpus()
+    corpus.add_doc("This is a document.").tokens = [(0, 4)]
+    corpus.add_doc("Another document.")
+    copy = teanga.read_yaml_str(corpus.to_yaml_str())
+    assert corpus == copy
+    copy.doc_by_id(corpus.order[0])._author = "John"
+    assert corpus != copy
+    reordered = teanga.text_corpus()
+    reordered.add_doc("Another document.")
+    reordered.add_doc("This is a document.").tokens = [(0, 4)]
+    assert corpus != reordered
+
+def test_transform_chain():
+    corpus = teanga.Corpus()
+    corpus.add_layer_meta("en")
+    corpus.add_layer_meta("de")
+    corpus.add_doc(en="Ab", de="Cd")
+    corpus = (corpus.transform("en", lambda x: x + "!")
+              .transform("de", lambda x: x + "?")
+              .transform("en", lambda x: x + ".")
+              .lower())
+    doc = next(iter(corpus.docs))
+    assert doc.en == "ab!."
+    assert doc.de == "cd?"
+
+def test_yaml_mixed_layers():
+    corpus = teanga.text_corpus()
+    corpus.add_doc("A b")
+    corpus.add_doc("C d").tokens = [(0, 1), (2, 3)]
+    corpus.add_doc("E f")
+    yaml_str = corpus.to_yaml_str()
+    assert yaml_str.count("tokens: ") == 1
+    assert teanga.read_yaml_str(yaml_str) == corpus
+
+def test_meta_yaml_after_add_layer():
+    corpus = teanga.text_corpus()
+    corpus.add_doc("This is a document.")
+    assert "pos:" not in corpus.to_yaml_str()
+    corpus.add_layer_meta("pos", layer_type="seq", base="tokens")
+    assert "    pos:\n        type: seq\n" in corpus.to_yaml_str()
+
+def test_parse_json():
+    import io
+    from teanga.corpus import parse
+    from teanga.stream import read_json_obj
+    corpus = teanga.text_corpus()
+    corpus.add_doc("A smile \U0001F600").tokens = [(0, 1), (2, 7)]
+    corpus.add_doc("Another document.")._score = 1e-05
+    json_str = corpus.to_json_str()
+    stream = parse(io.BytesIO(json_str.encode("utf-8")), format="json")
+    assert stream.meta == corpus.meta
+    assert list(stream) == list(corpus.docs)
+    chunked = read_json_obj(io.BytesIO(json_str.encode("utf-8")), 3)
+    assert dict(chunked) == json.loads(json_str)
+
+def test_search_index_added_document():
+    import io
+    from teanga.corpus import parse
+    corpus = teanga.text_corpus()
+    corpus.add_layer_meta("pos", layer_type="seq", base="tokens",
+                          data=["N", "V"])
+    doc = corpus.add_doc("A b")
+    doc.tokens = [(0, 1), (2, 3)]
+    doc.pos = ["N", "V"]
+    stream = parse(io.StringIO(corpus.to_yaml_str()))
+    corpus2 = teanga.Corpus()
+    corpus2.meta = stream.meta
+    for doc in stream:
+        corpus2.add_doc(doc)
+    assert list(corpus2.search(pos="V")) == [doc.id]
+    doc.pos = ["N", "N"]
+    assert list(corpus2.search(pos="V")) == []
+
+def test_search_index_shared_document():
+    a = teanga.text_corpus()
+    a.add_layer_meta("pos", layer_type="seq", base="tokens", data=["N", "V"])
+    doc = a.add_doc("A b")
+    doc.tokens = [(0, 1), (2, 3)]
+    doc.pos = ["N", "V"]
+    assert list(a.search(pos="V")) == [doc.id]
+    b = teanga.Corpus()
+    b.meta = a.meta
+    b.add_doc(doc)
+    assert list(b.search(pos="V")) == [doc.id]
+    doc.pos = ["N", "N"]
+    assert list(a.search(pos="V")) == []
+    assert list(b.search(pos="V")) == []
+    doc.text = "C d"
+    assert list(a.doc_ids) == [doc.id]
+
+def test_search_index_in_place_edit():
+    corpus = teanga.text_corpus()
+    corpus.add_layer_meta("pos", layer_type="seq", base="tokens",
+                          data=["N", "V"])
+    doc = corpus.add_doc("A b")
+    doc.tokens = [(0, 1), (2, 3)]
+    doc.pos = ["N", "V"]
+    assert list(corpus.search(pos="V")) == [doc.id]
+    doc.pos.data[1] = "N"
+    assert list(corpus.search(pos="V")) == []
+    assert list(corpus.search(pos="N")) == [doc.id]
+
+def test_layer_meta_not_shared():
+    corpus = teanga.text_corpus()
+    other = teanga.text_corpus()
+    corpus.meta["text"].meta["lang"] = "ga"
+    assert corpus.meta["tokens"].meta == {}
+    assert other.meta["text"].meta == {}
+    assert "_lang" not in other.to_json_str()
+
+def test_meta_changed_in_place():
+    corpus = teanga.text_corpus()
+    corpus.add_doc("This is a document.")
+    corpus.to_json_str()
+    corpus.to_yaml_str()
+    corpus.meta["text"].meta["lang"] = "en"
+    assert '"_lang": "en"' in corpus.to_json_str()
+    corpus.meta["title"] = teanga.LayerDesc("characters")
+    assert "    title:\n        type: characters\n" in corpus.to_yaml_str()
+    doc = corpus.add_doc(text="Another document.", title="A title")
+    assert doc.title == "A title"
+
+class _WriteOnly:
+    """A buffer with only a `write` method"""
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, s):
+        self.chunks.append(s)
+
+def test_to_yaml_write_only_buffer():
+    corpus = teanga.text_corpus()
+    corpus.add_doc("This is a document.")
+    buf = _WriteOnly()
+    corpus.to_yaml(buf)
+    assert "".join(buf.chunks) == corpus.to_yaml_str()
+
+def test_to_json_write_only_buffer():
+    corpus = teanga.text_corpus()
+    corpus.add_doc("This is a document.")
+    buf = _WriteOnly()
+    corpus.to_json(buf)
+    assert "".join(buf.chunks) == corpus.to_json_str()
+
+def test_add_docs_failure_updates_order():
+    corpus = teanga.text_corpus()
+    corpus.add_doc("First document.")
+    corpus.order
+    with pytest.raises(Exception):
+        corpus.add_docs(["Second document.", {"unknown": "Third"}])
+    assert corpus.order == list(corpus.doc_ids)
+    assert len(corpus.order) == 2
+    assert corpus[-1].text == "Second document."
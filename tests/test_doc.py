@@ -64,3 +64,26 @@ def test_list_other_layer_duality():
     # But are not lists
     assert type(doc.tokens) == teanga.document.SpanLayer
     
+
+def test_add_layers_order():
+    corpus = teanga.Corpus()
+    corpus.add_layer_meta("text")
+    corpus.add_layer_meta("words", layer_type="span", base="text")
+    corpus.add_layer_meta("pos", layer_type="seq", base="words", data="string")
+    corpus.add_layer_meta("a", layer_type="seq", base="b")
+    corpus.add_layer_meta("b", layer_type="seq", base="a")
+    doc = corpus.add_doc("This is")
+    doc.add_layers({"pos": ["DT", "VBZ"], "words": [(0, 4), (5, 7)]})
+    assert doc.pos.data == ["DT", "VBZ"]
+    try:
+        doc.add_layers({"a": [1], "b": [1]})
+        assert False
+    except Exception as e:
+        assert str(e) == "Layers a, b have cyclic sublayers."
+    doc = corpus.add_doc("That is")
+    try:
+        doc.add_layers({"words": [(0, 4), (5, 7)], "a": [1], "b": [1]})
+        assert False
+    except Exception as e:
+        assert str(e) == "Layers a, b have cyclic sublayers."
+    assert "words" not in doc